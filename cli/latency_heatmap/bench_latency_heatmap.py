@@ -0,0 +1,173 @@
+""" Benchmarks for the latency_heatmap readers and bucketing engines
+
+Scales the bundled demo.dat up (each copy shifted forward in time so the
+result looks like one long capture), reports rows/s for the csv row readers
+and the columnar readers, and times the original pure Python bucketing
+against the numpy engine on the same input.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from collections import defaultdict
+
+import numpy as np
+
+import latency_heatmap
+
+
+DEMO_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'demo.dat'
+)
+
+
+def calculate_data_reference(data_generator, min_num_values=40):
+    """ The original per-sample bucketing, kept as the baseline """
+    buckets = defaultdict(list)
+    min_time, max_time = sys.maxsize, 0
+    min_latency, max_latency = sys.maxsize, 1
+    for t, latency in data_generator:
+        buckets[t].append(latency)
+        min_time, max_time = min(min_time, t), max(max_time, t)
+        min_latency, max_latency = min(
+            min_latency, latency), max(max_latency, latency)
+
+    num_values = min(min_num_values, max_latency + 1)
+    v_bucket_interval = (max_latency / float(num_values))
+
+    data = np.zeros(
+        shape=(max_time - min_time + 1, num_values),
+        dtype=np.float32
+    )
+
+    for bucket in buckets:
+        x_index = bucket - min_time
+        count = Counter(buckets[bucket])
+        total = float(sum(count.values()))
+        for key in count:
+            y_index = min(int((key) / v_bucket_interval), num_values - 1)
+            value = count[key] / total
+            data[x_index][y_index] += value
+    return latency_heatmap.PlotData(
+        data=data, min_time=min_time, max_time=max_time,
+        min_latency=min_latency, max_latency=max_latency,
+        num_values=num_values
+    )
+
+
+def scale_demo(output, scale):
+    """ Write demo.dat repeated scale times, shifting each copy in time """
+    with open(DEMO_FILE, 'r') as f:
+        header = next(f)
+        rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+
+    seconds = [int(row[1]) for row in rows]
+    span = max(seconds) - min(seconds) + 1
+    output.write(header)
+    for copy in range(scale):
+        offset = copy * span
+        for row in rows:
+            row = list(row)
+            row[1] = str(int(row[1]) + offset)
+            output.write('\t'.join(row))
+            output.write('\n')
+    return len(rows) * scale
+
+
+def convert_to_tl(ab_path, output):
+    """ Write the time and latency columns of an ab file as tl csv """
+    output.write('time,latency\n')
+    with open(ab_path, 'r') as f:
+        for t, latency in latency_heatmap.read_ab_data(f):
+            output.write('{0},{1}\n'.format(t, latency))
+
+
+def timed(fn, *args, **kwargs):
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - start
+
+
+def bench_bucketing(path, num_values):
+    # Parse once up front so that we only time the bucketing itself
+    with open(path, 'r') as f:
+        rows = list(latency_heatmap.read_data(f, 'ab'))
+
+    reference, reference_s = timed(
+        calculate_data_reference, iter(rows), num_values
+    )
+    vectorized, vectorized_s = timed(
+        latency_heatmap.calculate_data, iter(rows), num_values
+    )
+
+    times, latencies = latency_heatmap.read_columns(
+        latency_heatmap.iter_chunks(iter(rows))
+    )
+    _, columns_s = timed(
+        latency_heatmap.bucket_columns, times, latencies, num_values
+    )
+
+    assert reference.data.shape == vectorized.data.shape
+    assert np.allclose(reference.data, vectorized.data, atol=1e-5)
+
+    print('{0:<24} {1:>8.3f}s'.format('python bucketing', reference_s))
+    for name, seconds in (
+            ('numpy from rows', vectorized_s),
+            ('numpy from columns', columns_s)):
+        print('{0:<24} {1:>8.3f}s ({2:.1f}x)'.format(
+            name, seconds, reference_s / seconds))
+
+
+def _count_rows(rows):
+    return sum(1 for _ in rows)
+
+
+def _count_chunks(chunks):
+    return sum(len(times) for times, _ in chunks)
+
+
+def bench_readers(paths):
+    readers = (
+        ('ab', 'csv rows', latency_heatmap.read_ab_data, _count_rows),
+        ('ab', 'columns', latency_heatmap.read_ab_columns, _count_chunks),
+        ('tl', 'csv rows', latency_heatmap.read_tl_data, _count_rows),
+        ('tl', 'columns', latency_heatmap.read_tl_columns, _count_chunks),
+    )
+    for data_type, name, reader, count in readers:
+        with open(paths[data_type], 'r') as f:
+            rows, seconds = timed(count, reader(f))
+        print('{0:<24} {1:>8.3f}s {2:>12,.0f} rows/s'.format(
+            '{0} {1}'.format(data_type, name), seconds, rows / seconds))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the latency heatmap bucketing engines',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--scale', type=int, default=1000,
+        help='How many copies of demo.dat to benchmark against'
+    )
+    parser.add_argument(
+        '--num-values', type=int, default=40,
+        help='The number of vertical latency buckets to generate'
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.NamedTemporaryFile('w', suffix='.dat') as scaled, \
+            tempfile.NamedTemporaryFile('w', suffix='.csv') as scaled_tl:
+        rows = scale_demo(scaled, args.scale)
+        scaled.flush()
+        convert_to_tl(scaled.name, scaled_tl)
+        scaled_tl.flush()
+        print('Benchmarking {0} rows ({1}x demo.dat)'.format(rows, args.scale))
+        bench_readers({'ab': scaled.name, 'tl': scaled_tl.name})
+        bench_bucketing(scaled.name, args.num_values)
@@ -2,10 +2,20 @@ from __future__ import print_function
 
 import argparse
 import csv
+import glob
+import io
+import itertools
+import json
+import mmap
+import os
+import shutil
+import struct
 import sys
-from collections import Counter
-from collections import defaultdict
+import tempfile
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import sleep
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
@@ -15,6 +25,10 @@ import numpy as np
 # Supported converters for different data formats
 # ab = Apache Benchmark -g output
 # tl = csv of time,latency pairs
+#
+# The read_*_data functions yield one (time, latency) row at a time, the
+# read_*_columns functions yield chunks of (times, latencies) numpy arrays
+# and only ever parse the two columns we need.
 
 
 def read_ab_data(f):
@@ -31,17 +45,187 @@ def read_tl_data(f):
         yield int(time), int(latency)
 
 
+def _parse_columns(lines, delimiter, usecols):
+    """ Parse just the time and latency columns of some lines of input """
+    pairs = np.loadtxt(
+        lines, delimiter=delimiter, usecols=usecols, dtype=np.int64,
+        ndmin=2
+    )
+    return pairs[:, 0].copy(), pairs[:, 1].copy()
+
+
+def _mmap_chunks(input_file, chunk_bytes):
+    """ Yield newline aligned chunks of bytes from an mmap of input_file
+
+    Raises (before yielding anything) if input_file can not be mapped, for
+    example when it is a pipe.
+    """
+    mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunks():
+        with mapped:
+            # Skip the header
+            start = mapped.find(b'\n') + 1 if len(mapped) else 0
+            while 0 < start < len(mapped):
+                end = mapped.rfind(b'\n', start, start + chunk_bytes) + 1
+                if end <= start:
+                    # A single line longer than chunk_bytes
+                    end = mapped.find(b'\n', start) + 1 or len(mapped)
+                if start + chunk_bytes >= len(mapped):
+                    end = len(mapped)
+                yield mapped[start:end]
+                start = end
+    return chunks()
+
+
+def _line_chunks(input_file, chunk_bytes):
+    """ Yield lists of lines for inputs we can't mmap, such as stdin """
+    next(input_file, None)
+    while True:
+        lines = input_file.readlines(chunk_bytes)
+        if not lines:
+            return
+        yield lines
+
+
+def _read_columns(input_file, delimiter, usecols, chunk_bytes):
+    try:
+        chunks = _mmap_chunks(input_file, chunk_bytes)
+    except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+        chunks = _line_chunks(input_file, chunk_bytes)
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = io.BytesIO(chunk)
+        times, latencies = _parse_columns(chunk, delimiter, usecols)
+        if len(times):
+            yield times, latencies
+
+
+# (delimiter, (time column, latency column)) of each data format
+column_formats = {
+    'ab': ('\t', (1, 4)),
+    'tl': (',', (0, 1)),
+}
+
+
+def read_ab_columns(f, chunk_bytes=1 << 22):
+    return _read_columns(f, *column_formats['ab'], chunk_bytes=chunk_bytes)
+
+
+def read_tl_columns(f, chunk_bytes=1 << 22):
+    return _read_columns(f, *column_formats['tl'], chunk_bytes=chunk_bytes)
+
+
 converters = {
-    'ab': read_ab_data,
-    'tl': read_tl_data
+    'ab': read_ab_columns,
+    'tl': read_tl_columns
 }
 
 # Common functionality for bucketing latency and drawing plots
 
 
+def read_chunks(input_file, data_format='ab'):
+    return converters[data_format](input_file)
+
+
 def read_data(input_file, data_format='ab'):
-    for time, latency in converters[data_format](input_file):
-        yield time, latency
+    for times, latencies in read_chunks(input_file, data_format):
+        for time, latency in zip(times.tolist(), latencies.tolist()):
+            yield time, latency
+
+
+# Binary cache of parsed (time, latency) columns, so re-rendering the same
+# capture with different options doesn't have to parse the text again.
+#
+# Layout: a 32 byte header (magic, version, header size, row count) followed
+# by all the times as little endian int64 and then all the latencies as
+# little endian int32, which lets us memory map both columns without copies.
+
+CACHE_MAGIC = b'LHEATMAP'
+CACHE_VERSION = 1
+_CACHE_HEADER = struct.Struct('<8sIIQ')
+_CACHE_HEADER_SIZE = 32
+
+
+def cache_path(data_path, data_format='ab'):
+    return '{0}.{1}.lhc'.format(data_path, data_format)
+
+
+def cache_is_fresh(path, data_path):
+    """ True if the cache at path exists and is newer than data_path """
+    return (
+        os.path.exists(path) and
+        os.path.getmtime(path) >= os.path.getmtime(data_path)
+    )
+
+
+def read_cache(path):
+    """ Memory map the (times, latencies) columns of a cache file """
+    with open(path, 'rb') as f:
+        header = f.read(_CACHE_HEADER.size)
+    if len(header) != _CACHE_HEADER.size:
+        raise ValueError('{0} is not a latency heatmap cache'.format(path))
+    magic, version, header_size, rows = _CACHE_HEADER.unpack(header)
+    if magic != CACHE_MAGIC:
+        raise ValueError('{0} is not a latency heatmap cache'.format(path))
+    if version != CACHE_VERSION:
+        raise ValueError('{0} has unsupported cache version {1}'.format(
+            path, version))
+    if rows == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+
+    times = np.memmap(
+        path, dtype='<i8', mode='r', offset=header_size, shape=(rows,)
+    )
+    latencies = np.memmap(
+        path, dtype='<i4', mode='r', offset=header_size + 8 * rows,
+        shape=(rows,)
+    )
+    return times, latencies
+
+
+def write_cache(path, chunks):
+    """ Pass chunks through unchanged while writing them to a cache file
+
+    The times are written straight to the cache and the latencies to a
+    temporary file that is appended once the input is exhausted, so this
+    never holds more than one chunk in memory. The cache only appears at
+    path once it is complete.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    rows = 0
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as out, \
+            tempfile.TemporaryFile(dir=directory) as latencies_out:
+        try:
+            out.write(b'\0' * _CACHE_HEADER_SIZE)
+            for times, latencies in chunks:
+                out.write(np.asarray(times, dtype='<i8').tobytes())
+                latencies_out.write(
+                    np.asarray(latencies, dtype='<i4').tobytes()
+                )
+                rows += len(times)
+                yield times, latencies
+
+            latencies_out.seek(0)
+            shutil.copyfileobj(latencies_out, out)
+            out.seek(0)
+            out.write(_CACHE_HEADER.pack(
+                CACHE_MAGIC, CACHE_VERSION, _CACHE_HEADER_SIZE, rows
+            ))
+            out.close()
+            os.chmod(out.name, 0o644)
+            os.replace(out.name, path)
+        finally:
+            if os.path.exists(out.name):
+                os.unlink(out.name)
+
+
+def read_cached_chunks(input_file, data_format='ab'):
+    """ Like read_chunks, but reads and maintains a binary cache """
+    path = cache_path(input_file.name, data_format)
+    if cache_is_fresh(path, input_file.name):
+        return iter([read_cache(path)])
+    return write_cache(path, read_chunks(input_file, data_format))
 
 
 PlotData = namedtuple(
@@ -49,62 +233,841 @@ PlotData = namedtuple(
     ['data',
      'min_latency', 'max_latency',
      'min_time', 'max_time',
-     'num_values']
+     'num_values',
+     'quantiles', 'summary', 'edges', 'resolution']
 )
+# quantiles maps a label (e.g. p99) to the per column latency of that
+# quantile, summary holds stats over the whole input, edges are the
+# num_values + 1 latency edges of the vertical buckets and resolution is the
+# number of seconds in each column (min_time and max_time count columns),
+# all are optional
+PlotData.__new__.__defaults__ = (None, None, None, None)
 
+# Quantiles overlaid on the heatmap and reported in summaries
+DEFAULT_QUANTILES = (0.5, 0.99, 0.999)
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999, 0.9999)
 
-def calculate_data(data_generator, min_num_values=40):
-    buckets = defaultdict(list)
-    min_time, max_time = sys.maxint, 0
-    min_latency, max_latency = sys.maxint, 1
-    for time, latency in data_generator:
-        buckets[time].append(latency)
-        min_time, max_time = min(min_time, time), max(max_time, time)
-        min_latency, max_latency = min(
-            min_latency, latency), max(max_latency, latency)
+# How latencies are split into the vertical buckets of the heatmap
+BUCKET_SCHEMES = ('linear', 'log', 'adaptive')
+
+
+def quantile_label(quantile):
+    return 'p{0:g}'.format(quantile * 100)
+
+
+# Durations in microseconds, used for input time units and resolutions
+DURATION_UNITS = {'us': 1, 'ms': 1000, 's': 10 ** 6, 'min': 60 * 10 ** 6,
+                  'h': 3600 * 10 ** 6}
+
+
+def parse_duration(value):
+    """ Parse a duration such as 100ms, 1s or 5min into microseconds """
+    number = value.rstrip('abcdefghijklmnopqrstuvwxyz')
+    unit = value[len(number):] or 's'
+    try:
+        micros = int(round(float(number) * DURATION_UNITS[unit]))
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(
+            'expected a duration such as 100ms, 1s or 1min, got {0}'.format(
+                value))
+    if micros <= 0:
+        raise argparse.ArgumentTypeError('durations must be positive')
+    return micros
+
+
+def bucket_times(chunks, time_step):
+    """ Floor the times of (times, latencies) chunks to time_step buckets
+
+    Times count time_step input units afterwards, e.g. a time_step of 100
+    on millisecond times gives 100ms buckets.
+    """
+    for times, latencies in chunks:
+        if time_step != 1:
+            times = np.asarray(times) // time_step
+        yield times, latencies
+
+
+def downsample_factor(num_times, width):
+    """ How many time buckets to merge into each of at most ~width columns """
+    if not width:
+        return 1
+    return max(1, -(-num_times // width))
+
+
+def iter_chunks(data_generator, chunk_size=1 << 16):
+    """ Group (time, latency) pairs into chunks of typed numpy arrays
+
+    Only chunk_size rows are ever held as Python objects at once, everything
+    else lives in int64 arrays.
+    """
+    while True:
+        flat = np.fromiter(
+            itertools.chain.from_iterable(
+                itertools.islice(data_generator, chunk_size)
+            ),
+            dtype=np.int64
+        )
+        if len(flat) == 0:
+            return
+        pairs = flat.reshape(-1, 2)
+        yield pairs[:, 0].copy(), pairs[:, 1].copy()
+
+
+def read_columns(chunks):
+    """ Concatenate (times, latencies) chunks into two contiguous arrays """
+    times, latencies = [], []
+    for chunk_times, chunk_latencies in chunks:
+        times.append(chunk_times)
+        latencies.append(chunk_latencies)
+    if not times:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if len(times) == 1:
+        # Don't copy a single (possibly memory mapped) chunk
+        return times[0], latencies[0]
+    return np.concatenate(times), np.concatenate(latencies)
+
+
+def bucket_edges(num_values, min_latency, max_latency, scheme='linear',
+                 quantile_fn=None):
+    """ The latency edges of num_values vertical buckets
+
+    linear buckets are all max_latency / num_values wide. log buckets grow
+    geometrically from the smallest latency, so a handful of huge outliers
+    don't squash everything else into the first bucket. adaptive buckets
+    each hold roughly the same share of the samples, their edges come from
+    quantile_fn which maps an array of quantiles to latencies. Repeated
+    adaptive edges are dropped, so there may be fewer than num_values
+    buckets.
+    """
+    low = max(min_latency, 1)
+    if scheme == 'log' and num_values > 1 and low < max_latency:
+        # The first bucket holds everything below the smallest latency
+        return np.r_[0.0, np.geomspace(low, max_latency, num_values)]
+    if scheme == 'adaptive' and num_values > 1:
+        inner = quantile_fn(np.arange(1, num_values) / float(num_values))
+        return np.unique(np.r_[0.0, np.clip(inner, 0, max_latency),
+                               max_latency])
+    if scheme not in BUCKET_SCHEMES:
+        raise ValueError('Unknown bucket scheme {0}'.format(scheme))
+    return np.linspace(0, max_latency, num_values + 1)
+
+
+def assign_buckets(latencies, edges, scheme='linear'):
+    """ The vertical bucket index of every latency given bucket edges """
+    num_values = len(edges) - 1
+    if scheme == 'linear':
+        # Dividing is cheaper than searching and matches the original
+        # bucketing exactly
+        v_bucket_interval = edges[-1] / float(num_values)
+        return np.minimum(
+            (latencies / v_bucket_interval).astype(np.int64), num_values - 1
+        )
+    return np.clip(
+        np.searchsorted(edges, latencies, side='right') - 1,
+        0, num_values - 1
+    )
+
+
+def bucket_columns(times, latencies, min_num_values=40,
+                   quantiles=DEFAULT_QUANTILES, scheme='linear', width=None,
+                   resolution=1.0):
+    """ Build the normalized (time x latency bucket) matrix from arrays
+
+    Every event is bucketed once, into a cell of both its vertical bucket
+    and its HeatmapHistogram bucket, so a single bincount gives the exact
+    heatmap counts and the per column histograms that the quantiles and
+    summary come from. Those are within the histogram's precision of the
+    exact values.
+
+    :param times: An array of integer times (time buckets) of each event
+    :param latencies: An array of latencies (ms) of each event, aligned with
+        times
+    :param min_num_values: The number of vertical latency buckets to use, if
+        there are fewer latency values than this we use that instead
+    :param quantiles: The quantiles to compute for every second
+    :param scheme: How to split latencies into buckets, one of
+        BUCKET_SCHEMES
+    :param width: Merge adjacent time buckets so there are at most about
+        this many columns, None to keep every time bucket
+    :param resolution: The number of seconds in each time bucket
+    """
+    times = np.asarray(times)
+    latencies = np.asarray(latencies)
+    if len(times) == 0:
+        raise ValueError('No latency data to bucket')
 
-    num_values = min(min_num_values, max_latency + 1)
+    min_time, max_time = int(times.min()), int(times.max())
+    min_latency, max_latency = int(latencies.min()), int(latencies.max())
+    histogram = HeatmapHistogram()
+    histogram.min_latency, histogram.max_latency = min_latency, max_latency
+    max_latency = max(max_latency, 1)
 
+    # Columns are aligned to multiples of factor time buckets, just like
+    # HeatmapHistogram.merged_counts
+    factor = downsample_factor(max_time - min_time + 1, width)
+    min_time, max_time = min_time // factor, max_time // factor
+    num_times = max_time - min_time + 1
+    histogram.min_time, histogram.num_times = min_time, num_times
+    if factor == 1:
+        x_index = times - min_time
+    else:
+        x_index = times // factor - min_time
+
+    # Small latencies index lookup tables much faster than we can bucket
+    # every one of them. Histogram buckets only depend on the whole
+    # milliseconds, so fractional latencies can look those up too
+    integer = latencies.dtype.kind in 'iu'
+    small = min_latency >= 0 and max_latency < max(len(latencies), 1 << 16)
+    lookup = integer and small
+    if integer:
+        histogram.latency_sum = int(latencies.sum(dtype=np.int64))
+        keys = np.arange(max_latency + 1) if lookup else latencies
+        fine = histogram.bucket_index(keys)
+    else:
+        whole = latencies.astype(np.int64)
+        histogram.latency_sum = int(whole.sum())
+        keys = latencies
+        if small:
+            fine = histogram.bucket_index(np.arange(max_latency + 1))[whole]
+        else:
+            fine = histogram.bucket_index(whole)
+        del whole
+    if scheme == 'adaptive':
+        # The edges follow the distribution, which we need up front
+        histogram.totals = np.bincount(fine[latencies] if lookup else fine)
     # If we want N buckets on the vertical, we have to divide the
     # latency data into those buckets
-    v_bucket_interval = (max_latency / float(num_values))
+    edges = histogram.edges(min_num_values, scheme)
+    num_values = len(edges) - 1
+    coarse = assign_buckets(keys, edges, scheme)
+
+    # Both bucket indices never decrease with the latency, so their sum
+    # tells every (histogram bucket, vertical bucket) pair apart
+    cells = fine + coarse
+    num_cells = int(cells.max()) + 1
+    cell_fine = np.full(num_cells, -1, dtype=np.int64)
+    cell_fine[cells] = fine
+    if lookup:
+        cells = cells[latencies]
+    counts = np.bincount(
+        x_index * num_cells + cells, minlength=num_times * num_cells
+    ).reshape(num_times, num_cells)
 
-    data = np.zeros(
-        shape=(max_time - min_time + 1, num_values),
-        dtype=np.float32
+    # Cells no event landed in are empty, carrying the previous bucket
+    # forward keeps the indices sorted for sum_runs
+    seen = cell_fine >= 0
+    cell_coarse = np.maximum.accumulate(
+        np.where(seen, np.arange(num_cells) - cell_fine, 0)
     )
+    cell_fine = np.maximum.accumulate(np.maximum(cell_fine, 0))
+    histogram.counts = sum_runs(counts, cell_fine, int(cell_fine[-1]) + 1)
+    histogram.totals = histogram.counts.sum(axis=0)
 
-    for bucket in buckets:
-        x_index = bucket - min_time
-        count = Counter(buckets[bucket])
-        total = float(sum(count.values()))
-        for key in count:
-            y_index = min(int((key) / v_bucket_interval), num_values - 1)
-            value = count[key] / total
-            data[x_index][y_index] += value
     return PlotData(
-        data=data, min_time=min_time, max_time=max_time,
+        data=normalize_counts(sum_runs(counts, cell_coarse, num_values)),
+        min_time=min_time, max_time=max_time,
         min_latency=min_latency, max_latency=max_latency,
-        num_values=num_values
+        num_values=num_values,
+        quantiles=histogram.quantile_series(quantiles),
+        summary=histogram.summary(), edges=edges,
+        resolution=resolution * factor
+    )
+
+
+def sum_runs(counts, keys, num_keys):
+    """ Sum the columns of counts with the same key into column key
+
+    keys must never decrease, so every key is one contiguous run of
+    columns that np.add.reduceat sums in one go.
+    """
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    result = np.zeros((len(counts), num_keys), dtype=np.int64)
+    result[:, keys[starts]] = np.add.reduceat(
+        counts[:, :len(keys)], starts, axis=1, dtype=np.int64
+    )
+    return result
+
+
+def normalize_counts(counts):
+    """ Each second is normalized by the number of events in that second """
+    totals = counts.sum(axis=1, keepdims=True)
+    return (counts / np.maximum(totals, 1)).astype(np.float32)
+
+
+def calculate_data(data_generator, min_num_values=40):
+    times, latencies = read_columns(iter_chunks(data_generator))
+    return bucket_columns(times, latencies, min_num_values=min_num_values)
+
+
+class HeatmapHistogram(object):
+    """ Fixed size log-linear latency histograms, one per time bucket
+
+    Latencies below 2 ** precision are counted exactly, above that every
+    power of two is split into 2 ** (precision - 1) sub buckets (the same
+    layout an HdrHistogram uses), so the relative error of a bucket is at
+    most 2 ** -(precision - 1). Memory is O(seconds x buckets) no matter how
+    many samples are added, and the buckets are only re-binned into the
+    final vertical buckets (and adjacent time buckets merged into wider
+    columns) when we draw. Bucket columns are only allocated up to the
+    largest latency seen so far.
+
+    :param precision: The number of bits of latency precision to keep
+    :param max_latency: Latencies larger than this are clamped to it
+    """
+
+    def __init__(self, precision=7, max_latency=2 ** 31 - 1):
+        self.precision = precision
+        self.max_trackable = max_latency
+        self.num_buckets = int(self.bucket_index(max_latency)) + 1
+        self.counts = np.zeros((0, 0), dtype=np.uint32)
+        # Bucket counts and latency sum over all seconds, for summaries
+        self.totals = np.zeros(0, dtype=np.int64)
+        self.latency_sum = 0
+        self.min_time = None
+        self.num_times = 0
+        self.min_latency = None
+        self.max_latency = None
+
+    @property
+    def max_time(self):
+        return self.min_time + self.num_times - 1
+
+    def bucket_index(self, latencies):
+        """ Map latencies to their log-linear bucket, vectorized """
+        latencies = np.clip(
+            np.asarray(latencies, dtype=np.int64), 0, self.max_trackable
+        )
+        half = 1 << (self.precision - 1)
+        # frexp's exponent is the bit length of each (integer) latency
+        _, bits = np.frexp(latencies.astype(np.float64))
+        shift = np.maximum(bits - self.precision, 0)
+        return shift * half + (latencies >> shift)
+
+    def bucket_values(self):
+        """ The smallest latency that lands in each bucket """
+        index = np.arange(self.num_buckets, dtype=np.int64)
+        half = 1 << (self.precision - 1)
+        shift = np.maximum(index // half - 1, 0)
+        return (index - shift * half) << shift
+
+    def bucket_midpoints(self):
+        """ The middle of the latencies that land in each bucket """
+        values = self.bucket_values()
+        widths = np.diff(np.r_[values, values[-1] + 1])
+        return values + (widths - 1) / 2.0
+
+    def _reserve(self, low, high, columns):
+        if self.min_time is None:
+            self.min_time = low
+        new_min = min(low, self.min_time)
+        needed = max(high, self.max_time) - new_min + 1
+        offset = self.min_time - new_min
+        capacity, num_columns = self.counts.shape
+        if offset == 0 and needed <= capacity and columns <= num_columns:
+            self.num_times = needed
+            return
+
+        # Grow geometrically so a stream of new seconds (or of slightly
+        # larger latencies) is amortized O(1)
+        if needed > capacity:
+            capacity = max(needed, 2 * capacity, 64)
+        if columns > num_columns:
+            num_columns = min(
+                max(columns, 2 * num_columns, 1 << self.precision),
+                self.num_buckets
+            )
+        counts = np.zeros((capacity, num_columns), dtype=np.uint32)
+        counts[offset:offset + self.num_times, :self.counts.shape[1]] = (
+            self.counts[:self.num_times]
+        )
+        self.counts = counts
+        self.totals = np.r_[
+            self.totals,
+            np.zeros(num_columns - len(self.totals), dtype=np.int64)
+        ]
+        self.min_time = new_min
+        self.num_times = needed
+
+    def add(self, times, latencies):
+        """ Add a chunk of (time, latency) samples """
+        times = np.asarray(times, dtype=np.int64)
+        latencies = np.asarray(latencies, dtype=np.int64)
+        if len(times) == 0:
+            return
+
+        low, high = int(times.min()), int(times.max())
+        min_latency, max_latency = int(latencies.min()), int(latencies.max())
+        self._reserve(low, high, int(self.bucket_index(max_latency)) + 1)
+        if self.min_latency is None:
+            self.min_latency, self.max_latency = min_latency, max_latency
+        self.min_latency = min(self.min_latency, min_latency)
+        self.max_latency = max(self.max_latency, max_latency)
+
+        start = low - self.min_time
+        rows = high - low + 1
+        num_columns = self.counts.shape[1]
+        index = self.bucket_index(latencies)
+        self.totals += np.bincount(index, minlength=num_columns)
+        self.latency_sum += int(latencies.sum())
+        flat = (times - low) * num_columns + index
+        if rows * num_columns <= 8 * len(flat):
+            self.counts[start:start + rows] += np.bincount(
+                flat, minlength=rows * num_columns
+            ).reshape(rows, num_columns).astype(np.uint32)
+        else:
+            # A chunk spread over many seconds, don't allocate a dense
+            # matrix that would be mostly zeros
+            cells, counts = np.unique(flat, return_counts=True)
+            window = self.counts[start:start + rows].reshape(-1)
+            window[cells] += counts.astype(np.uint32)
+
+    def merge(self, other):
+        """ Fold another histogram into this one, aligned by time """
+        if other.precision != self.precision:
+            raise ValueError('Can only merge histograms of equal precision')
+        if other.min_time is None:
+            return self
+
+        other_columns = other.counts.shape[1]
+        self._reserve(other.min_time, other.max_time, other_columns)
+        if self.min_latency is None:
+            self.min_latency = other.min_latency
+            self.max_latency = other.max_latency
+        self.min_latency = min(self.min_latency, other.min_latency)
+        self.max_latency = max(self.max_latency, other.max_latency)
+
+        start = other.min_time - self.min_time
+        self.counts[start:start + other.num_times, :other_columns] += (
+            other.counts[:other.num_times]
+        )
+        self.totals[:other_columns] += other.totals
+        self.latency_sum += other.latency_sum
+        return self
+
+    def __getstate__(self):
+        # Don't ship the spare capacity between processes
+        state = dict(self.__dict__)
+        state['counts'] = self.counts[:self.num_times]
+        return state
+
+    def edges(self, min_num_values=40, scheme='linear'):
+        """ The vertical bucket edges of every sample we have seen """
+        if self.min_time is None:
+            raise ValueError('No latency data to bucket')
+        max_latency = max(self.max_latency, 1)
+        return bucket_edges(
+            min(min_num_values, max_latency + 1), self.min_latency,
+            max_latency, scheme,
+            quantile_fn=lambda q: self._quantiles(self.totals[None, :], q)[0]
+        )
+
+    def num_columns(self, factor=1):
+        """ The number of columns of factor merged time buckets """
+        if self.min_time is None:
+            return 0
+        return self.max_time // factor - self.min_time // factor + 1
+
+    def merged_counts(self, factor=1, start=0, stop=None):
+        """ Bucket counts of columns [start, stop) of factor time buckets
+
+        Column i holds time buckets [(min_time // factor + i) * factor,
+        (min_time // factor + i + 1) * factor), so columns line up no matter
+        where the data starts.
+        """
+        if stop is None:
+            stop = self.num_columns(factor)
+        if factor == 1:
+            return self.counts[start:stop]
+        offset = self.min_time % factor
+        low, high = start * factor - offset, stop * factor - offset
+        counts = np.zeros(
+            ((stop - start) * factor, self.counts.shape[1]), dtype=np.int64
+        )
+        fine = self.counts[max(low, 0):min(high, self.num_times)]
+        counts[max(-low, 0):max(-low, 0) + len(fine)] = fine
+        return counts.reshape(
+            stop - start, factor, self.counts.shape[1]
+        ).sum(axis=1)
+
+    def rebin(self, edges, scheme='linear', start=0, stop=None, factor=1):
+        """ Re-bin columns [start, stop) into the vertical buckets of edges
+
+        Returns the (columns x len(edges) - 1) matrix of raw counts, where
+        each column merges factor time buckets.
+        """
+        if self.min_time is None:
+            raise ValueError('No latency data to bucket')
+        counts = self.merged_counts(factor, start, stop)
+        num_values = len(edges) - 1
+
+        # Only buckets up to the largest latency we saw can be non zero
+        used = int(self.bucket_index(max(self.max_latency, 1))) + 1
+        y_index = assign_buckets(self.bucket_values()[:used], edges, scheme)
+        return sum_runs(counts, y_index, num_values)
+
+    def _quantiles(self, counts, quantiles):
+        """ The quantiles of each row of bucket counts, nan if it's empty """
+        cumulative = np.cumsum(counts, axis=1, dtype=np.int64)
+        totals = cumulative[:, -1]
+        values = np.clip(
+            self.bucket_midpoints()[:counts.shape[1]],
+            self.min_latency, self.max_latency
+        )
+        result = np.full((len(counts), len(quantiles)), np.nan)
+        for i, quantile in enumerate(quantiles):
+            ranks = np.maximum(np.ceil(quantile * totals), 1)
+            index = np.minimum(
+                (cumulative < ranks[:, None]).sum(axis=1), counts.shape[1] - 1
+            )
+            result[:, i] = np.where(totals > 0, values[index], np.nan)
+        return result
+
+    def quantile_series(self, quantiles=DEFAULT_QUANTILES, start=0,
+                        stop=None, factor=1):
+        """ The given quantiles of columns [start, stop), by label """
+        result = self._quantiles(
+            self.merged_counts(factor, start, stop), quantiles
+        )
+        return dict(
+            (quantile_label(q), result[:, i]) for i, q in enumerate(quantiles)
+        )
+
+    def summary(self, quantiles=SUMMARY_QUANTILES):
+        """ Summary statistics over every sample we have seen """
+        count = int(self.totals.sum())
+        result = {
+            'count': count,
+            'min': self.min_latency,
+            'max': self.max_latency,
+            'mean': self.latency_sum / float(count) if count else None,
+        }
+        values = self._quantiles(self.totals[None, :], quantiles)[0]
+        for quantile, value in zip(quantiles, values):
+            result[quantile_label(quantile)] = (
+                None if np.isnan(value) else float(value)
+            )
+        return result
+
+    def to_plot_data(self, min_num_values=40, quantiles=DEFAULT_QUANTILES,
+                     scheme='linear', width=None, resolution=1.0):
+        """ Re-bin the histograms into num_values buckets and ~width columns
+
+        :param resolution: The number of seconds in each time bucket
+        """
+        edges = self.edges(min_num_values, scheme)
+        factor = downsample_factor(self.num_times, width)
+        counts = self.rebin(edges, scheme, factor=factor)
+        return PlotData(
+            data=normalize_counts(counts),
+            min_time=self.min_time // factor,
+            max_time=self.max_time // factor,
+            min_latency=self.min_latency,
+            max_latency=max(self.max_latency, 1),
+            num_values=counts.shape[1],
+            quantiles=self.quantile_series(quantiles, factor=factor),
+            summary=self.summary(), edges=edges,
+            resolution=resolution * factor
+        )
+
+
+class LiveHeatmap(object):
+    """ Keeps a PlotData up to date as samples are appended
+
+    Only the columns touched by new samples are re-binned into the plot
+    matrix (and have their quantiles recomputed), so an update costs
+    O(new rows) rather than a full recompute. The whole matrix is only
+    rebuilt when the vertical buckets or the columns change, which happens
+    when a new maximum latency (or an earlier time) shows up, or when the
+    data grows wide enough that more time buckets are merged per column.
+    Adaptive buckets move with almost every update, so they always rebuild
+    the whole matrix.
+
+    :param min_num_values: The number of vertical latency buckets to use
+    :param precision: The number of bits of latency precision to keep
+    :param quantiles: The quantiles to compute for every column
+    :param scheme: How to split latencies into buckets, one of
+        BUCKET_SCHEMES
+    :param width: Merge adjacent time buckets so there are at most about
+        this many columns, None to keep every time bucket
+    :param resolution: The number of seconds in each time bucket
+    """
+
+    def __init__(self, min_num_values=40, precision=7,
+                 quantiles=DEFAULT_QUANTILES, scheme='linear', width=None,
+                 resolution=1.0):
+        self.min_num_values = min_num_values
+        self.scheme = scheme
+        self.width = width
+        self.resolution = resolution
+        self.quantiles = tuple(quantiles)
+        self.histogram = HeatmapHistogram(precision=precision)
+        self.data = np.zeros((0, 0), dtype=np.float32)
+        self.quantile_data = np.zeros((0, len(self.quantiles)))
+        self.edges = None
+        self.factor = 1
+        self._layout = None
+        self._dirty = None
+        self._num_times = 0
+
+    def add(self, times, latencies):
+        if len(times) == 0:
+            return
+        self.histogram.add(times, latencies)
+        low, high = int(np.min(times)), int(np.max(times))
+        if self._dirty is not None:
+            low = min(low, self._dirty[0])
+            high = max(high, self._dirty[1])
+        self._dirty = (low, high)
+
+    def _update(self, start, stop):
+        histogram = self.histogram
+        self.data[start:stop] = normalize_counts(
+            histogram.rebin(
+                self.edges, self.scheme, start, stop, self.factor
+            )
+        )
+        self.quantile_data[start:stop] = histogram._quantiles(
+            histogram.merged_counts(self.factor, start, stop), self.quantiles
+        )
+
+    def plot_data(self):
+        histogram = self.histogram
+        edges = histogram.edges(self.min_num_values, self.scheme)
+        factor = downsample_factor(histogram.num_times, self.width)
+        min_time = histogram.min_time // factor
+        layout = (min_time, factor, tuple(edges))
+        num_times = histogram.num_columns(factor)
+        if layout != self._layout:
+            self.edges, self.factor = edges, factor
+            self.data = np.zeros(
+                (num_times, len(edges) - 1), dtype=np.float32
+            )
+            self.quantile_data = np.zeros((num_times, len(self.quantiles)))
+            self._update(0, num_times)
+            self._layout = layout
+        elif self._dirty is not None:
+            if num_times > len(self.data):
+                capacity = max(num_times, 2 * len(self.data))
+                data = np.zeros(
+                    (capacity, self.data.shape[1]), dtype=np.float32
+                )
+                data[:len(self.data)] = self.data
+                quantile_data = np.zeros((capacity, len(self.quantiles)))
+                quantile_data[:len(self.data)] = self.quantile_data
+                self.data, self.quantile_data = data, quantile_data
+            # New times always extend the dirty range to the end, but any
+            # gap between the old end and the dirty range needs filling too
+            self._update(
+                min(self._dirty[0] // factor - min_time, self._num_times),
+                self._dirty[1] // factor - min_time + 1
+            )
+        self._dirty = None
+        self._num_times = num_times
+
+        return PlotData(
+            data=self.data[:num_times],
+            min_time=min_time, max_time=min_time + num_times - 1,
+            min_latency=histogram.min_latency,
+            max_latency=max(histogram.max_latency, 1),
+            num_values=self.data.shape[1],
+            quantiles=dict(
+                (quantile_label(q), self.quantile_data[:num_times, i])
+                for i, q in enumerate(self.quantiles)
+            ),
+            summary=histogram.summary(), edges=self.edges,
+            resolution=self.resolution * factor
+        )
+
+
+class TailReader(object):
+    """ Reads the rows that were appended to a data file since last time
+
+    Only complete lines are parsed, a trailing partial line is kept until
+    the rest of it is written. If the file shrinks (it was truncated or
+    rotated) we start reading it again from the top.
+
+    :param path: The data file to follow
+    :param data_format: The format of the data file, e.g. ab
+    """
+
+    def __init__(self, path, data_format='ab', chunk_bytes=1 << 22):
+        self.path = path
+        self.delimiter, self.usecols = column_formats[data_format]
+        self.chunk_bytes = chunk_bytes
+        self.offset = 0
+        self.partial = b''
+        self.header = True
+
+    def read_chunks(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.offset:
+                self.offset, self.partial, self.header = 0, b'', True
+            f.seek(self.offset)
+            while True:
+                data = f.read(self.chunk_bytes)
+                if not data:
+                    return
+                self.offset += len(data)
+                data = self.partial + data
+                end = data.rfind(b'\n') + 1
+                lines, self.partial = data[:end], data[end:]
+                if self.header and lines:
+                    lines = lines[lines.find(b'\n') + 1:]
+                    self.header = False
+                if not lines:
+                    continue
+                times, latencies = _parse_columns(
+                    io.BytesIO(lines), self.delimiter, self.usecols
+                )
+                if len(times):
+                    yield times, latencies
+
+
+def follow_file(path, dataset, data_format='ab', min_num_values=40,
+                precision=7, interval=5.0, quantiles=DEFAULT_QUANTILES,
+                summary_path=None, scheme='linear', time_step=1, width=None,
+                resolution=1.0):
+    """ Re-render the heatmap of a growing data file every interval seconds
+
+    Runs until interrupted.
+    """
+    reader = TailReader(path, data_format)
+    live = LiveHeatmap(
+        min_num_values=min_num_values, precision=precision,
+        quantiles=quantiles, scheme=scheme, width=width,
+        resolution=resolution
+    )
+    try:
+        while True:
+            updated = False
+            for times, latencies in bucket_times(
+                    reader.read_chunks(), time_step):
+                live.add(times, latencies)
+                updated = True
+            if updated:
+                plt_data = live.plot_data()
+                draw_figure(dataset, plt_data)
+                if summary_path:
+                    write_summary(summary_path, dataset, plt_data)
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def histogram_chunks(chunks, precision=7):
+    """ Fold chunks of (times, latencies) arrays into a HeatmapHistogram """
+    histogram = HeatmapHistogram(precision=precision)
+    for times, latencies in chunks:
+        # Bound the temporaries of very large (e.g. cached) chunks
+        for i in range(0, len(times), 1 << 20):
+            histogram.add(times[i:i + (1 << 20)], latencies[i:i + (1 << 20)])
+    return histogram
+
+
+def stream_data(chunks, min_num_values=40, precision=7,
+                quantiles=DEFAULT_QUANTILES, scheme='linear', width=None,
+                resolution=1.0):
+    """ Like calculate_data but in O(seconds x buckets) memory
+
+    Chunks are folded into a HeatmapHistogram one at a time, so this is safe
+    to use on unbounded streams such as a load generator on stdin.
+    """
+    histogram = histogram_chunks(chunks, precision=precision)
+    return histogram.to_plot_data(
+        min_num_values=min_num_values, quantiles=quantiles, scheme=scheme,
+        width=width, resolution=resolution
     )
 
 
+def expand_paths(patterns):
+    """ Expand any globs in patterns, keeping plain paths (and -) as is """
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError('No input files match {0}'.format(pattern))
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def histogram_file(path, data_format='ab', precision=7, cache=False,
+                   time_step=1):
+    """ Parse and bucket a single input file into a HeatmapHistogram """
+    with open(path, 'r') as input_file:
+        if cache:
+            chunks = read_cached_chunks(input_file, data_format)
+        else:
+            chunks = read_chunks(input_file, data_format)
+        return histogram_chunks(
+            bucket_times(chunks, time_step), precision=precision
+        )
+
+
+def histogram_files(paths, data_format='ab', precision=7, cache=False,
+                    jobs=None, time_step=1):
+    """ Bucket many input files in parallel and merge them by time
+
+    Each file is parsed and bucketed in its own worker process, only the
+    per file histograms (O(seconds x buckets)) come back to be merged.
+    """
+    histogram = HeatmapHistogram(precision=precision)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        partials = executor.map(
+            partial(
+                histogram_file, data_format=data_format,
+                precision=precision, cache=cache, time_step=time_step
+            ),
+            paths
+        )
+        for file_histogram in partials:
+            histogram.merge(file_histogram)
+    return histogram
+
+
+def format_latency(value):
+    if value >= 10:
+        return '{0:2.0f}'.format(value)
+    return '{0:.2g}'.format(value)
+
+
 def draw_figure(dataset, plt_data):
     plt.figure(figsize=(12, 6))
 
-    v_bucket_interval = (plt_data.max_latency / float(plt_data.num_values))
+    # Bucket i spans [edges[i], edges[i + 1]), interpolating between them
+    # maps latencies to heatmap rows and back whatever the bucket scheme
+    edges = plt_data.edges
+    if edges is None:
+        edges = np.linspace(0, plt_data.max_latency, plt_data.num_values + 1)
+    rows = np.arange(len(edges))
+    resolution = plt_data.resolution or 1.0
 
     plt.pcolormesh(
         plt_data.data.T, cmap='RdYlBu_r',
         vmin=0, vmax=1.0,
         edgecolor='k', linewidth=0.01
     )
+    # Overlay the per second quantiles, in the same units as the buckets
+    if plt_data.quantiles:
+        x = np.arange(len(plt_data.data)) + 0.5
+        styles = itertools.cycle(['-', '--', ':', '-.'])
+        for (label, values), style in zip(plt_data.quantiles.items(), styles):
+            plt.plot(
+                x, np.interp(values, edges, rows), color='k',
+                linestyle=style, linewidth=1, label=label
+            )
+        plt.legend(loc='upper right')
     plt.title('Latency Heatmap of {0}'.format(dataset))
     plt.ylabel('Response Time (ms)')
     plt.xlabel('Time (s)')
     plt.colorbar()
     plt.grid(False)
     plt.xlim(0, plt_data.max_time - plt_data.min_time + 1)
+    plt.gca().xaxis.set_major_formatter(
+        ticker.FuncFormatter(lambda x, pos: '{0:g}'.format(x * resolution))
+    )
     plt.ylim(0, plt_data.num_values)
     # This way we see the actual latency values of the buckets
     # this locator puts ticks at regular intervals
@@ -112,11 +1075,48 @@ def draw_figure(dataset, plt_data):
     plt.gca().yaxis.set_major_locator(loc)
     plt.gca().yaxis.set_major_formatter(
         ticker.FuncFormatter(
-            lambda x, pos: ('{0:2.0f}'.format(x * v_bucket_interval))
+            lambda x, pos: format_latency(np.interp(x, rows, edges))
         )
     )
 
     plt.savefig('{0}.png'.format(dataset), format='png')
+    plt.close()
+
+
+def summary_dict(dataset, plt_data):
+    """ The summary and per second quantiles of plt_data, JSON ready """
+    def values(series):
+        return [None if np.isnan(v) else float(v) for v in series]
+
+    quantiles = plt_data.quantiles or {}
+    return {
+        'dataset': dataset,
+        'min_time': plt_data.min_time,
+        'max_time': plt_data.max_time,
+        'resolution': plt_data.resolution or 1.0,
+        'summary': plt_data.summary,
+        'quantiles': dict(
+            (label, values(series)) for label, series in quantiles.items()
+        ),
+    }
+
+
+def write_summary(path, dataset, plt_data):
+    """ Write the summary and per second quantiles of plt_data as JSON """
+    with open(path, 'w') as f:
+        json.dump(summary_dict(dataset, plt_data), f, sort_keys=True)
+
+
+def parse_quantiles(value):
+    """ Parse a comma separated list of percentiles, e.g. 50,99,99.9 """
+    try:
+        percentiles = [float(p) for p in value.split(',') if p.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected comma separated percentiles, got {0}'.format(value))
+    if any(not 0 < p <= 100 for p in percentiles):
+        raise argparse.ArgumentTypeError('percentiles must be in (0, 100]')
+    return tuple(p / 100.0 for p in percentiles)
 
 
 def parse_args():
@@ -125,10 +1125,11 @@ def parse_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
     parser.add_argument(
-        'data_file', nargs='?', type=argparse.FileType('r'),
-        default=sys.stdin,
+        'data_files', nargs='*', default=['-'], metavar='data_file',
         help=(
-            'Input file, if not supplied stdin is presumed'
+            'Input files or globs, if not supplied stdin is presumed. '
+            'Multiple files (e.g. one per load generating host) are '
+            'bucketed in parallel and merged by time'
         )
     )
     parser.add_argument(
@@ -139,7 +1140,7 @@ def parse_args():
         )
     )
     parser.add_argument(
-        '--data-type', choices=['ab', 'tl'], metavar='', default='ab',
+        '--data-type', choices=sorted(converters), metavar='', default='ab',
         help=(
             'Type of the input data. Choices are: [(ab -> Apache Benchmark), '
             '(tl -> Time,Latency CSV)]'
@@ -153,12 +1154,168 @@ def parse_args():
             'choose the number of latency values for this instead'
         )
     )
+    parser.add_argument(
+        '--buckets', choices=BUCKET_SCHEMES, default='linear',
+        help=(
+            'How to split latencies into the vertical buckets. linear '
+            'buckets are equally wide, log buckets grow geometrically so '
+            'long tails don\'t squash everything into the bottom bucket and '
+            'adaptive buckets each hold about the same number of samples'
+        )
+    )
+    parser.add_argument(
+        '--time-unit', choices=('s', 'ms', 'us'), default='s',
+        help=(
+            'The unit of the input times. ab only records whole seconds, tl '
+            'files may use finer times'
+        )
+    )
+    parser.add_argument(
+        '--resolution', type=parse_duration, default='1s',
+        help=(
+            'The width of each time bucket, e.g. 100ms, 1s or 1min. Must be '
+            'a whole multiple of --time-unit'
+        )
+    )
+    parser.add_argument(
+        '--width', type=int, default=None,
+        help=(
+            'Merge adjacent time buckets so the heatmap has at most about '
+            'this many columns, e.g. 1000 for long runs. By default every '
+            'time bucket is kept'
+        )
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help=(
+            'Keep only fixed size per second histograms instead of every '
+            'sample, so memory does not grow with the input (e.g. when '
+            'piping a live load generator through stdin)'
+        )
+    )
+    parser.add_argument(
+        '--precision', type=int, default=7,
+        help=(
+            'Bits of latency precision kept by --stream and when merging '
+            'multiple data files. Latencies are exact below 2^precision and '
+            'within 2^-(precision - 1) above it'
+        )
+    )
+    parser.add_argument(
+        '--cache', action='store_true',
+        help=(
+            'Keep a binary copy of the parsed input next to the data file '
+            '(<data_file>.<data_type>.lhc) and use it instead of re-parsing '
+            'the data file whenever it is newer than the data file'
+        )
+    )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--percentiles', type=parse_quantiles, default=DEFAULT_QUANTILES,
+        metavar='P1,P2,...',
+        help=(
+            'Comma separated percentiles to compute for every second and '
+            'overlay on the heatmap, pass an empty string to disable '
+            '(default: 50,99,99.9)'
+        )
+    )
+    parser.add_argument(
+        '--summary-json', metavar='PATH',
+        help=(
+            'Also write summary statistics and the per second percentiles '
+            'as JSON to this path'
+        )
+    )
+    parser.add_argument(
+        '--follow', action='store_true',
+        help=(
+            'Keep reading rows as they are appended to the data file and '
+            're-render the heatmap every --interval seconds until '
+            'interrupted'
+        )
+    )
+    parser.add_argument(
+        '--interval', type=float, default=5.0,
+        help='Seconds between re-renders in --follow mode'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=None,
+        help=(
+            'The number of processes used to bucket multiple data files, '
+            'defaults to the number of CPUs'
+        )
+    )
+
+    args = parser.parse_args()
+    try:
+        args.data_files = expand_paths(args.data_files)
+    except ValueError as e:
+        parser.error(str(e))
+    if '-' in args.data_files and len(args.data_files) > 1:
+        parser.error('stdin can not be combined with other data files')
+    if args.cache and args.data_files == ['-']:
+        parser.error('--cache needs a data file, it can not cache stdin')
+    if args.follow and (len(args.data_files) != 1 or
+                        args.data_files == ['-']):
+        parser.error('--follow needs exactly one data file')
+    unit = DURATION_UNITS[args.time_unit]
+    if args.resolution % unit:
+        parser.error('--resolution must be a whole multiple of --time-unit '
+                     '({0})'.format(args.time_unit))
+    # How many input time units go in each time bucket
+    args.time_step = args.resolution // unit
+    args.resolution = args.resolution / float(DURATION_UNITS['s'])
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    data_generator = read_data(args.data_file, args.data_type)
-    data = calculate_data(data_generator, min_num_values=args.num_values)
+    if args.follow:
+        follow_file(
+            args.data_files[0], args.dataset_name,
+            data_format=args.data_type, min_num_values=args.num_values,
+            precision=args.precision, interval=args.interval,
+            quantiles=args.percentiles, summary_path=args.summary_json,
+            scheme=args.buckets, time_step=args.time_step, width=args.width,
+            resolution=args.resolution
+        )
+        sys.exit(0)
+
+    if len(args.data_files) > 1:
+        histogram = histogram_files(
+            args.data_files, data_format=args.data_type,
+            precision=args.precision, cache=args.cache, jobs=args.jobs,
+            time_step=args.time_step
+        )
+        data = histogram.to_plot_data(
+            min_num_values=args.num_values, quantiles=args.percentiles,
+            scheme=args.buckets, width=args.width,
+            resolution=args.resolution
+        )
+    else:
+        if args.data_files == ['-']:
+            data_file = sys.stdin
+        else:
+            data_file = open(args.data_files[0], 'r')
+        if args.cache:
+            chunks = read_cached_chunks(data_file, args.data_type)
+        else:
+            chunks = read_chunks(data_file, args.data_type)
+        chunks = bucket_times(chunks, args.time_step)
+        if args.stream:
+            data = stream_data(
+                chunks, min_num_values=args.num_values,
+                precision=args.precision, quantiles=args.percentiles,
+                scheme=args.buckets, width=args.width,
+                resolution=args.resolution
+            )
+        else:
+            times, latencies = read_columns(chunks)
+            data = bucket_columns(
+                times, latencies, min_num_values=args.num_values,
+                quantiles=args.percentiles, scheme=args.buckets,
+                width=args.width, resolution=args.resolution
+            )
     draw_figure(args.dataset_name, data)
+    if args.summary_json:
+        write_summary(args.summary_json, args.dataset_name, data)
@@ -0,0 +1,292 @@
+""" Latency heatmaps of block I/O traces, per disk and read / write
+
+The same time x latency heatmaps that cli/latency_heatmap draws for HTTP
+latencies, for the biosnoop style traces of iotrace: times are fractional
+seconds and latencies float milliseconds. One stable sort groups the I/O
+by (disk, io_type), then each group is counted in one np.bincount over
+(time, latency bucket) and a second one over (I/O size, latency bucket)
+shows how latency depends on the size of the I/O:
+
+    for heatmap in io_heatmaps(open_trace('ios'), resolution=0.1):
+        heatmap.disk, heatmap.io_type, heatmap.plot.data
+
+The bucketing and drawing come from cli/latency_heatmap/latency_heatmap.py,
+which has to be importable, e.g. from this directory
+
+    PYTHONPATH=../../cli/latency_heatmap python io_heatmap.py ios ios
+"""
+import argparse
+import json
+from collections import namedtuple
+
+import matplotlib.pyplot as plt
+import matplotlib.ticker as ticker
+import numpy as np
+
+from iotrace import open_trace
+
+try:
+    import latency_heatmap
+except ImportError:
+    raise ImportError(
+        'io_heatmap.py needs cli/latency_heatmap on the PYTHONPATH, e.g. '
+        'from this directory: PYTHONPATH=../../cli/latency_heatmap python '
+        'io_heatmap.py ios ios'
+    )
+
+# plot is a latency_heatmap.PlotData of the group, sizes a SizeData
+IOHeatmap = namedtuple('IOHeatmap', ('disk', 'io_type', 'plot', 'sizes'))
+# The (size x latency bucket) counts of a group, data is normalized per
+# size, size_edges are the power of two byte edges of the sizes and edges
+# the latency edges (ms) shared with the heatmap
+SizeData = namedtuple('SizeData', ('data', 'counts', 'size_edges', 'edges'))
+
+
+def size_buckets(sizes):
+    """ The power of two bucket of every I/O size, and the bucket edges
+
+    Bucket i holds sizes in [edges[i], edges[i + 1]), sizes below one byte
+    (e.g. flushes) go in the first bucket.
+    """
+    exponents = np.floor(np.log2(np.maximum(sizes, 1))).astype(np.int64)
+    low, high = int(exponents.min()), int(exponents.max())
+    return exponents - low, 2 ** np.arange(low, high + 2, dtype=np.int64)
+
+
+def group_quantiles(keys, latencies, quantiles, num_keys):
+    """ The quantiles of the latencies of each key, nan if it has none
+
+    One sort by (key, latency) puts every key's latencies in a contiguous
+    sorted run, so each quantile is a single fancy index.
+
+    :returns: A (num_keys, len(quantiles)) array
+    """
+    counts = np.bincount(keys, minlength=num_keys)
+    result = np.full((num_keys, len(quantiles)), np.nan)
+    if not len(latencies):
+        return result
+    ordered = latencies[np.lexsort((latencies, keys))]
+    starts = np.cumsum(counts) - counts
+    for i, quantile in enumerate(quantiles):
+        ranks = np.maximum(np.ceil(quantile * counts), 1).astype(np.int64)
+        index = np.minimum(starts + ranks - 1, len(ordered) - 1)
+        result[:, i] = np.where(counts > 0, ordered[index], np.nan)
+    return result
+
+
+def io_heatmaps(trace, resolution=1.0, min_num_values=40,
+                quantiles=latency_heatmap.DEFAULT_QUANTILES, scheme='log',
+                width=None):
+    """ Yield the heatmap of every (disk, io_type) group of an
+    iotrace.IOTrace
+
+    The latency buckets and time columns are shared by every group so their
+    heatmaps can be compared directly. Latencies are bucketed in
+    microseconds so log buckets start below a millisecond, the edges are
+    converted back to milliseconds. Groups are bucketed one at a time, so
+    only one group's (time x latency bucket) counts are held at once.
+
+    :param resolution: The number of seconds in each time bucket
+    :param min_num_values: The number of vertical latency buckets
+    :param quantiles: The quantiles to overlay on each heatmap
+    :param scheme: How to split latencies into buckets, one of
+        latency_heatmap.BUCKET_SCHEMES
+    :param width: Merge adjacent time buckets so there are at most about
+        this many columns, None to keep every time bucket
+    :returns: A generator of IOHeatmap, one per group with any I/O
+    """
+    if not len(trace):
+        raise ValueError('No I/O to bucket')
+    times = np.asarray(trace['time'])
+    latencies = np.asarray(trace['latency_ms'])
+    micros = latencies * 1000.0
+
+    ticks = ((times - times.min()) // resolution).astype(np.int64)
+    factor = latency_heatmap.downsample_factor(int(ticks.max()) + 1, width)
+    columns = ticks // factor
+    num_times = int(columns.max()) + 1
+
+    edges = latency_heatmap.bucket_edges(
+        min_num_values, float(micros.min()), float(micros.max()), scheme,
+        quantile_fn=lambda q: np.quantile(micros, q)
+    )
+    num_values = len(edges) - 1
+    values = latency_heatmap.assign_buckets(micros, edges, scheme)
+    edges = edges / 1000.0
+    sizes, size_edges = size_buckets(np.asarray(trace['bytes']))
+    num_sizes = len(size_edges) - 1
+
+    # One stable sort puts every group's I/O in a contiguous run
+    io_types = trace.categories['io_type']
+    groups = (
+        trace['disk'].astype(np.int64) * len(io_types) + trace['io_type']
+    )
+    order = np.argsort(groups, kind='stable')
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    summary_quantiles = latency_heatmap.SUMMARY_QUANTILES
+    for run in np.split(order, bounds):
+        group_columns, group_values = columns[run], values[run]
+        group_latencies = latencies[run]
+        counts = np.bincount(
+            group_columns * num_values + group_values,
+            minlength=num_times * num_values
+        ).reshape(num_times, num_values)
+        size_counts = np.bincount(
+            sizes[run] * num_values + group_values,
+            minlength=num_sizes * num_values
+        ).reshape(num_sizes, num_values)
+        series = group_quantiles(
+            group_columns, group_latencies, quantiles, num_times
+        )
+        summaries = group_quantiles(
+            np.zeros(len(run), dtype=np.int64), group_latencies,
+            summary_quantiles, 1
+        )[0]
+        summary = {
+            'count': len(run),
+            'min': float(group_latencies.min()),
+            'max': float(group_latencies.max()),
+            'mean': float(group_latencies.mean()),
+        }
+        for quantile, value in zip(summary_quantiles, summaries.tolist()):
+            summary[latency_heatmap.quantile_label(quantile)] = value
+        plot = latency_heatmap.PlotData(
+            data=latency_heatmap.normalize_counts(counts),
+            min_latency=summary['min'], max_latency=summary['max'],
+            min_time=0, max_time=num_times - 1, num_values=num_values,
+            quantiles=dict(
+                (latency_heatmap.quantile_label(q), series[:, i])
+                for i, q in enumerate(quantiles)
+            ),
+            summary=summary, edges=edges, resolution=resolution * factor
+        )
+        sized = SizeData(
+            data=latency_heatmap.normalize_counts(size_counts),
+            counts=size_counts, size_edges=size_edges, edges=edges
+        )
+        disk, io_type = divmod(int(groups[run[0]]), len(io_types))
+        yield IOHeatmap(
+            trace.categories['disk'][disk], io_types[io_type], plot, sized
+        )
+
+
+def format_bytes(value):
+    for unit in ('', 'K', 'M', 'G'):
+        if value < 1024:
+            return '{0:g}{1}'.format(value, unit)
+        value /= 1024.0
+    return '{0:g}T'.format(value)
+
+
+def draw_size_figure(dataset, sizes):
+    """ Draw the latency distribution of each I/O size to
+    <dataset>-sizes.png
+    """
+    plt.figure(figsize=(12, 6))
+    rows = np.arange(len(sizes.edges))
+    plt.pcolormesh(
+        sizes.data.T, cmap='RdYlBu_r', vmin=0, vmax=1.0,
+        edgecolor='k', linewidth=0.01
+    )
+    plt.title('Latency by I/O Size of {0}'.format(dataset))
+    plt.ylabel('Response Time (ms)')
+    plt.xlabel('I/O Size (bytes)')
+    plt.colorbar()
+    plt.grid(False)
+    plt.xticks(
+        np.arange(len(sizes.data)) + 0.5,
+        [format_bytes(s) for s in sizes.size_edges[:-1].tolist()]
+    )
+    plt.ylim(0, len(sizes.edges) - 1)
+    plt.gca().yaxis.set_major_locator(ticker.MultipleLocator(base=2.0))
+    plt.gca().yaxis.set_major_formatter(
+        ticker.FuncFormatter(lambda y, pos: latency_heatmap.format_latency(
+            np.interp(y, rows, sizes.edges)
+        ))
+    )
+    plt.savefig('{0}-sizes.png'.format(dataset), format='png')
+    plt.close()
+
+
+def group_name(dataset, heatmap):
+    return '{0}-{1}-{2}'.format(dataset, heatmap.disk, heatmap.io_type)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Generate Latency Heatmaps of block I/O traces, one per '
+                    'disk and I/O type',
+        epilog='cli/latency_heatmap has to be on the PYTHONPATH, e.g. from '
+               'this directory: PYTHONPATH=../../cli/latency_heatmap python '
+               'io_heatmap.py ios ios',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        'trace', help='A biosnoop style trace, or its .iotrace store'
+    )
+    parser.add_argument(
+        'dataset_name',
+        help=(
+            'Name of the dataset, each group is saved to '
+            '<dataset_name>-<disk>-<io_type>.png and '
+            '<dataset_name>-<disk>-<io_type>-sizes.png'
+        )
+    )
+    parser.add_argument(
+        '--num-values', type=int, default=40,
+        help='The number of vertical latency buckets to generate'
+    )
+    parser.add_argument(
+        '--buckets', choices=latency_heatmap.BUCKET_SCHEMES, default='log',
+        help='How to split latencies into the vertical buckets'
+    )
+    parser.add_argument(
+        '--resolution', type=latency_heatmap.parse_duration, default='1s',
+        help='The width of each time bucket, e.g. 10ms, 100ms or 1s'
+    )
+    parser.add_argument(
+        '--width', type=int, default=None,
+        help=(
+            'Merge adjacent time buckets so the heatmap has at most about '
+            'this many columns, e.g. 1000 for long runs. By default every '
+            'time bucket is kept'
+        )
+    )
+    parser.add_argument(
+        '--percentiles', type=latency_heatmap.parse_quantiles,
+        default=latency_heatmap.DEFAULT_QUANTILES, metavar='P1,P2,...',
+        help='Comma separated percentiles to overlay on each heatmap'
+    )
+    parser.add_argument(
+        '--summary-json', metavar='PATH',
+        help=(
+            'Also write the summary and per column percentiles of every '
+            'group as a JSON list to this path'
+        )
+    )
+    args = parser.parse_args()
+    args.resolution = args.resolution / float(
+        latency_heatmap.DURATION_UNITS['s']
+    )
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    heatmaps = io_heatmaps(
+        open_trace(args.trace), resolution=args.resolution,
+        min_num_values=args.num_values, quantiles=args.percentiles,
+        scheme=args.buckets, width=args.width
+    )
+    summaries = []
+    for heatmap in heatmaps:
+        name = group_name(args.dataset_name, heatmap)
+        latency_heatmap.draw_figure(name, heatmap.plot)
+        draw_size_figure(name, heatmap.sizes)
+        if args.summary_json:
+            summary = latency_heatmap.summary_dict(name, heatmap.plot)
+            summary.update(disk=heatmap.disk, io_type=heatmap.io_type)
+            summaries.append(summary)
+    if args.summary_json:
+        with open(args.summary_json, 'w') as f:
+            json.dump(summaries, f, sort_keys=True)
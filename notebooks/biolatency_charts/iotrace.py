@@ -0,0 +1,311 @@
+""" Columnar storage of biosnoop / biolatency -T style I/O traces
+
+A trace such as ios looks like
+
+    TIME(s) COMM PID DISK T SECTOR BYTES LAT(ms)
+    0.000000000 java 13332 nvme0n1 R 215610648 32768 0.14
+
+Traces are parsed in chunks into typed NumPy columns, with the strings
+(COMM, DISK and T) stored as small integer codes into a list of categories,
+and min / max / count statistics are computed along the way. The columns
+are saved as .npy files next to a meta.json so later runs memory map them
+instead of parsing the text again:
+
+    trace = open_trace('ios')
+    writes = trace.codes('io_type', 'W')
+    trace['latency_ms'][writes]
+"""
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+STORE_VERSION = 2
+FIELDS = ('time', 'comm', 'pid', 'disk', 'io_type', 'sector', 'bytes',
+          'latency_ms')
+COLUMN_DTYPES = {
+    'time': np.float64,
+    'comm': np.uint16,
+    'pid': np.int32,
+    'disk': np.uint16,
+    'io_type': np.uint8,
+    'sector': np.int64,
+    'bytes': np.int64,
+    'latency_ms': np.float64,
+}
+CATEGORICAL = ('comm', 'disk', 'io_type')
+
+
+class Categories(object):
+    """ Assigns stable integer codes to the strings of a column """
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {v: i for i, v in enumerate(self.values)}
+
+    def encode(self, strings):
+        """ Codes of a list of byte strings """
+        lookup = {}
+        for raw in set(strings):
+            value = raw.decode('utf-8', 'replace')
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+            lookup[raw] = self.codes[value]
+        return np.fromiter(
+            map(lookup.__getitem__, strings), dtype=np.int64,
+            count=len(strings)
+        )
+
+
+class TraceStats(object):
+    """ Running count, min and max of the columns, and per category counts
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.skipped = 0
+        self.min = {}
+        self.max = {}
+        self.latency_sum = 0.0
+        self.category_counts = {name: {} for name in CATEGORICAL}
+
+    def add(self, columns, categories):
+        if not len(columns['time']):
+            return
+        self.count += len(columns['time'])
+        for name in ('time', 'bytes', 'latency_ms', 'sector'):
+            low = columns[name].min().item()
+            high = columns[name].max().item()
+            self.min[name] = min(self.min.get(name, low), low)
+            self.max[name] = max(self.max.get(name, high), high)
+        self.latency_sum += float(columns['latency_ms'].sum())
+        for name in CATEGORICAL:
+            counts = self.category_counts[name]
+            for code, count in enumerate(np.bincount(columns[name])):
+                if count:
+                    value = categories[name].values[code]
+                    counts[value] = counts.get(value, 0) + int(count)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'skipped': self.skipped,
+            'min': self.min,
+            'max': self.max,
+            'mean_latency_ms': (
+                self.latency_sum / self.count if self.count else None
+            ),
+            'category_counts': self.category_counts,
+        }
+
+
+def _chunks(f, chunk_bytes):
+    """ Newline aligned chunks of bytes from a binary file """
+    remainder = b''
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            if remainder.strip():
+                yield remainder
+            return
+        data = remainder + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            remainder = data
+            continue
+        remainder = data[end:]
+        yield data[:end]
+
+
+def _split_lines(chunk):
+    """ The fields of a chunk as 8 lists of byte strings, and how many
+    lines were skipped
+
+    The fast path transposes the split lines at once when every line has
+    exactly 8 fields. Otherwise we look at lines one by one, joining a COMM
+    that contains spaces and skipping lines that are too short.
+    """
+    rows = list(map(bytes.split, chunk.splitlines()))
+    if set(map(len, rows)) <= {8}:
+        tokens = list(itertools.chain.from_iterable(rows))
+        return [tokens[i::8] for i in range(8)], 0
+    complete, skipped = [], 0
+    for items in rows:
+        if len(items) < 8:
+            skipped += bool(items)
+            continue
+        if len(items) > 8:
+            items = [items[0], b' '.join(items[1:-6])] + items[-6:]
+        complete.append(items)
+    if not complete:
+        return [[] for _ in range(8)], skipped
+    return [list(field) for field in zip(*complete)], skipped
+
+
+def parse_trace(path, chunk_bytes=1 << 24, categories=None, stats=None):
+    """ Yield dicts of typed columns for every chunk of a trace
+
+    :param categories: A dict of column name to Categories, filled in as
+        new strings are seen
+    :param stats: An optional TraceStats to update
+    """
+    if categories is None:
+        categories = {name: Categories() for name in CATEGORICAL}
+    with open(path, 'rb') as f:
+        f.readline()
+        for chunk in _chunks(f, chunk_bytes):
+            fields, skipped = _split_lines(chunk)
+            if stats is not None:
+                stats.skipped += skipped
+            columns = {}
+            for name, values in zip(FIELDS, fields):
+                dtype = COLUMN_DTYPES[name]
+                if name in CATEGORICAL:
+                    column = categories[name].encode(values).astype(dtype)
+                else:
+                    # float() and int() parse bytes directly
+                    parse = float if dtype == np.float64 else int
+                    column = np.fromiter(
+                        map(parse, values), dtype=dtype, count=len(values)
+                    )
+                columns[name] = column
+            if stats is not None:
+                stats.add(columns, categories)
+            yield columns
+
+
+def store_path(path, out_dir=None):
+    """ Where the columns of the trace at path are stored """
+    base = path if out_dir is None else os.path.join(
+        out_dir, os.path.basename(path)
+    )
+    return base + '.iotrace'
+
+
+def ingest(path, out_dir=None, chunk_bytes=1 << 24):
+    """ Parse the trace at path into a column store and open it
+
+    Columns are appended to raw files chunk by chunk, so memory use is
+    bounded by chunk_bytes, then converted to .npy.
+    """
+    store = store_path(path, out_dir)
+    partial = store + '.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    categories = {name: Categories() for name in CATEGORICAL}
+    stats = TraceStats()
+    raw = {
+        name: open(os.path.join(partial, name + '.bin'), 'wb')
+        for name in FIELDS
+    }
+    try:
+        for columns in parse_trace(path, chunk_bytes, categories, stats):
+            for name in FIELDS:
+                raw[name].write(columns[name].tobytes())
+    finally:
+        for f in raw.values():
+            f.close()
+
+    for name in FIELDS:
+        bin_path = os.path.join(partial, name + '.bin')
+        dtype = np.dtype(COLUMN_DTYPES[name])
+        out = np.lib.format.open_memmap(
+            os.path.join(partial, name + '.npy'), mode='w+', dtype=dtype,
+            shape=(stats.count,)
+        )
+        if stats.count:
+            source = np.memmap(bin_path, dtype=dtype, mode='r')
+            step = max(chunk_bytes // dtype.itemsize, 1)
+            for start in range(0, stats.count, step):
+                out[start:start + step] = source[start:start + step]
+            del source
+        out.flush()
+        del out
+        os.remove(bin_path)
+
+    source = os.stat(path)
+    meta = {
+        'version': STORE_VERSION,
+        'source': os.path.abspath(path),
+        'source_size': source.st_size,
+        'source_mtime': source.st_mtime,
+        'fields': list(FIELDS),
+        'categories': {
+            name: categories[name].values for name in CATEGORICAL
+        },
+        'stats': stats.to_dict(),
+    }
+    with open(os.path.join(partial, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(store, ignore_errors=True)
+    os.rename(partial, store)
+    return IOTrace(store)
+
+
+def is_fresh(store, path):
+    """ Whether store was built from the current contents of path """
+    try:
+        with open(os.path.join(store, 'meta.json')) as f:
+            meta = json.load(f)
+        source = os.stat(path)
+    except (OSError, ValueError):
+        return False
+    return (
+        meta.get('version') == STORE_VERSION and
+        meta.get('source_size') == source.st_size and
+        meta.get('source_mtime') == source.st_mtime
+    )
+
+
+def open_trace(path, out_dir=None, chunk_bytes=1 << 24):
+    """ Open the column store of a trace, ingesting it first if needed
+
+    path may also be a .iotrace store itself.
+    """
+    if path.endswith('.iotrace') and os.path.isdir(path):
+        return IOTrace(path)
+    store = store_path(path, out_dir)
+    if is_fresh(store, path):
+        return IOTrace(store)
+    return ingest(path, out_dir, chunk_bytes)
+
+
+class IOTrace(object):
+    """ The memory mapped columns of an ingested trace
+
+    Columns are opened lazily, trace['latency_ms'] is a read only memmap.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        with open(os.path.join(store, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.categories = self.meta['categories']
+        self.stats = self.meta['stats']
+        self._columns = {}
+
+    def __len__(self):
+        return self.stats['count']
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            if name not in self.meta['fields']:
+                raise KeyError(name)
+            self._columns[name] = np.load(
+                os.path.join(self.store, name + '.npy'), mmap_mode='r'
+            )
+        return self._columns[name]
+
+    def codes(self, name, value):
+        """ A boolean mask of the rows whose categorical name is value """
+        values = self.categories[name]
+        if value not in values:
+            return np.zeros(len(self), dtype=bool)
+        return self[name] == values.index(value)
+
+    def labels(self, name):
+        """ The strings of a categorical column, e.g. labels('disk') """
+        return np.array(self.categories[name])[self[name]]
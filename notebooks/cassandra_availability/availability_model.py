@@ -0,0 +1,259 @@
+""" The analytic Cassandra availability model of cassandra_availability.ipynb
+
+Every function broadcasts like a NumPy ufunc, so a whole grid of vnodes,
+cluster sizes, failure rates or maintenance strategies is evaluated in one
+call. Scalar arguments still give scalar results. Run this file to evaluate
+maintenance strategies over a fleet and write the results as columns.
+"""
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+YEAR_SECONDS = 60.0 * 60 * 24 * 365
+CENTURY_SECONDS = 100 * YEAR_SECONDS
+# Seconds to reboot (or re-image) a node in place
+REBOOT_SECONDS = 60 * 5
+# Seconds to swap a node's EBS volume onto a new instance
+EBS_SWAP_SECONDS = 60 * 5
+
+MAINTENANCE_STRATEGIES = ('in-place', 'ebs', 'streaming', 'streaming-fast')
+# (bw_in, bw_out) in MB/s of each maintenance strategy, 1 Gbps vs 10 Gbps
+STRATEGY_BANDWIDTH = {
+    'in-place': (125, 25),
+    'ebs': (125, 25),
+    'streaming': (125, 25),
+    'streaming-fast': (125 * 10, 25 * 10),
+}
+
+
+def _result(value):
+    """ A NumPy scalar for 0-d results, the array otherwise """
+    return np.asarray(value)[()]
+
+
+# Boils down to "If I pick hosts 2 * (rf - 1) * vnode times, how many
+# distinct hosts will I have in expectation". Note that this is a slightly
+# optimistic estimate because Cassandra won't place two replicas of the
+# same token on the same machine or rack, but this is close enough for
+# the model
+# This is a variant of the Birthday Problem where we are interested
+# in the number of distinct values produced
+# http://www.randomservices.org/random/urn/Birthday.html
+def num_neighbors(n, v, rf, strategy="rack"):
+    n, v, rf = np.asarray(n), np.asarray(v), np.asarray(rf)
+    k = 2 * v * (rf - 1)
+    # As cassandra is rack aware, we assume #racks == #replicas
+    # This is maybe a bad assumption for some datacenter deployments.
+    # SimpleStrategy can pick any other node
+    n = np.where(np.asarray(strategy) == "rack", n - (n // rf), n - 1)
+    estimate = (n * (1.0 - (1.0 - 1.0 / n) ** k))
+    return _result(np.maximum(rf - 1, np.minimum(estimate, n)))
+
+
+def p_outage_given_failure(recovery_seconds, num_neighbors, rate_in_seconds):
+    x = np.multiply(recovery_seconds, num_neighbors) * rate_in_seconds
+    # 1 - exp(-x), without losing precision for tiny x
+    return _result(-np.expm1(-x))
+
+
+def global_rate(node_rate, nodes, split_probability):
+    return _result(np.multiply(node_rate, nodes) * split_probability)
+
+
+def recovery_seconds(size, bw_in, bw_out, neighbors, recovery='streaming'):
+    streaming = np.floor(
+        np.divide(size, np.minimum(bw_in, np.multiply(neighbors, bw_out)))
+    )
+    return _result(np.where(
+        np.asarray(recovery) == 'ebs', EBS_SWAP_SECONDS, streaming
+    ))
+
+
+def outages_per_century(
+        vnodes, failure_rate_per_century, num_nodes, rf, node_dataset_mb,
+        bw_in, bw_out, strategy='rack', recovery='streaming'):
+    """ The expected number of outages per century of one cluster
+
+    Failures are a Poisson process, so the number of outages per century is
+    Poisson distributed with this mean.
+    """
+    neighbors = num_neighbors(num_nodes, vnodes, rf, strategy)
+    recovery_s = recovery_seconds(
+        node_dataset_mb, bw_in, bw_out, neighbors, recovery
+    )
+    p_failure = p_outage_given_failure(
+        recovery_s, neighbors, np.divide(failure_rate_per_century,
+                                         CENTURY_SECONDS)
+    )
+    return global_rate(failure_rate_per_century, num_nodes, p_failure)
+
+
+def p_outage_cluster(fail_per_year, num_nodes, dataset_mib, bw_in, bw_out,
+                     maint_strategy='in-place', rf=3):
+    """ The chance that maintaining a cluster (one zone at a time) causes an
+    outage, because a neighbor fails while a node is down
+
+    :param maint_strategy: 'in-place' reboots or re-images the node, 'ebs'
+        swaps its volume onto a new instance and the others stream its data
+        onto a fresh node
+    """
+    neighbors = num_neighbors(num_nodes, 1, rf, strategy='rack')
+    maint_strategy = np.asarray(maint_strategy)
+    recovery_s = REBOOT_SECONDS + np.select(
+        [maint_strategy == 'in-place', maint_strategy == 'ebs'],
+        [0, EBS_SWAP_SECONDS],
+        recovery_seconds(dataset_mib, bw_in, bw_out, neighbors)
+    )
+    p_failure = p_outage_given_failure(
+        recovery_s, neighbors, np.divide(fail_per_year, YEAR_SECONDS)
+    )
+    # Each zone has to do maintenance
+    return _result(p_failure * rf)
+
+
+def p_any_outage(fail_per_year, num_nodes, dataset_mib, maint_strategy,
+                 rf=3):
+    """ The chance that one round of maintenance over the whole fleet
+    causes at least one outage
+
+    The fleet is the last axis of num_nodes and dataset_mib, every other
+    axis broadcasts, e.g. fail_per_year[:, None, None] and
+    maint_strategy[None, :, None] give a (rates, strategies) grid.
+    """
+    maint_strategy = np.asarray(maint_strategy)
+    bw_in = np.full(maint_strategy.shape, 0.0)
+    bw_out = np.full(maint_strategy.shape, 0.0)
+    for name, (strategy_in, strategy_out) in STRATEGY_BANDWIDTH.items():
+        bw_in = np.where(maint_strategy == name, strategy_in, bw_in)
+        bw_out = np.where(maint_strategy == name, strategy_out, bw_out)
+    p_cluster = p_outage_cluster(
+        fail_per_year, num_nodes, dataset_mib, bw_in, bw_out,
+        maint_strategy, rf
+    )
+    # 1 - prod(1 - p) over the fleet, in log space for thousands of clusters
+    return _result(-np.expm1(np.log1p(-p_cluster).sum(axis=-1)))
+
+
+def outages_per_year(maint_per_year, fail_per_year, fleet, strat='in-place',
+                     rf=3):
+    """ Expected outages per year caused by maintaining the fleet
+
+    :param fleet: (num_nodes, dataset_mib) of every cluster, as a list of
+        tuples or an (n, 2) array
+    """
+    fleet = np.asarray(fleet, dtype=np.float64).reshape(-1, 2)
+    p_any_fail = p_any_outage(
+        np.asarray(fail_per_year)[..., None], fleet[:, 0], fleet[:, 1],
+        np.asarray(strat)[..., None], rf
+    )
+    return _result(np.multiply(maint_per_year, p_any_fail))
+
+
+def outage_grid(maint_rates, fail_rates, strategies, fleet, rf=3):
+    """ Outages per year over every (strategy, failure rate, maintenance
+    rate) combination, as a dict of equal length columns
+    """
+    fleet = np.asarray(fleet, dtype=np.float64).reshape(-1, 2)
+    strategies = np.asarray(strategies)
+    fail_rates = np.asarray(fail_rates, dtype=np.float64)
+    maint_rates = np.asarray(maint_rates, dtype=np.float64)
+    # Only (strategy, failure rate) needs the fleet axis
+    p_any = p_any_outage(
+        fail_rates[None, :, None], fleet[:, 0], fleet[:, 1],
+        strategies[:, None, None], rf
+    )
+    outages = p_any[:, :, None] * maint_rates
+    strategy, fail, maint = np.meshgrid(
+        strategies, fail_rates, maint_rates, indexing='ij'
+    )
+    return {
+        'strategy': strategy.ravel(),
+        'failures_per_year': fail.ravel(),
+        'maintenance_per_year': maint.ravel(),
+        'p_outage_per_maintenance': np.broadcast_to(
+            p_any[:, :, None], outages.shape
+        ).ravel(),
+        'outages_per_year': outages.ravel(),
+    }
+
+
+def read_fleet(path):
+    """ (nodes, dataset_mib) of every cluster in a csv with those columns """
+    with open(path, newline='') as f:
+        rows = [
+            (float(row['nodes']), float(row['dataset_mib']))
+            for row in csv.DictReader(f)
+        ]
+    return np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+
+def write_columns(columns, output):
+    """ Write columns as csv to output ('-' for stdout), or as an .npz """
+    if output.endswith('.npz'):
+        np.savez(output, **columns)
+        return
+    f = sys.stdout if output == '-' else open(output, 'w', newline='')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(list(columns))
+        writer.writerows(zip(*(c.tolist() for c in columns.values())))
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def parse_floats(value):
+    return [float(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Outages caused by maintenance across a fleet'
+    )
+    parser.add_argument(
+        '--fleet', help='A csv with nodes and dataset_mib columns, one row '
+                        'per cluster. Defaults to a single cluster of '
+                        '--nodes and --dataset-mib'
+    )
+    parser.add_argument('--nodes', type=float, default=48)
+    parser.add_argument('--dataset-mib', type=float, default=500 * 1024)
+    parser.add_argument('--rf', type=int, default=3)
+    parser.add_argument(
+        '--maintenance-rates', type=parse_floats,
+        default=[1, 2, 4, 12, 24, 52, 365],
+        help='Comma separated maintenance rounds per year'
+    )
+    parser.add_argument(
+        '--failure-rates', type=parse_floats, default=[0.25],
+        help='Comma separated node failures per year'
+    )
+    parser.add_argument(
+        '--strategies', type=lambda v: v.split(','),
+        default=list(MAINTENANCE_STRATEGIES),
+        help='Comma separated of {0}'.format(', '.join(MAINTENANCE_STRATEGIES))
+    )
+    parser.add_argument(
+        '--output', default='-', help='A csv path, - for stdout, or .npz'
+    )
+    args = parser.parse_args()
+    unknown = set(args.strategies) - set(MAINTENANCE_STRATEGIES)
+    if unknown:
+        parser.error('Unknown strategies {0}'.format(', '.join(unknown)))
+
+    if args.fleet:
+        fleet = read_fleet(args.fleet)
+    else:
+        fleet = np.array([[args.nodes, args.dataset_mib]])
+    write_columns(
+        outage_grid(
+            args.maintenance_rates, args.failure_rates, args.strategies,
+            fleet, args.rf
+        ),
+        args.output
+    )
+
+
+if __name__ == '__main__':
+    main()
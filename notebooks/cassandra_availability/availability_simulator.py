@@ -0,0 +1,227 @@
+""" Monte Carlo check of the analytic availability model
+
+Builds real token rings, fails nodes as independent Poisson processes and
+counts how often a node fails while one of its neighbors (a node it shares
+a token range with) is still recovering, which is an outage for QUORUM with
+rf=3. Everything is vectorized so 1000 node, 256 vnode clusters can be run
+for many simulated centuries.
+"""
+import argparse
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from availability_model import CENTURY_SECONDS
+from availability_model import num_neighbors
+from availability_model import outages_per_century
+from availability_model import recovery_seconds
+
+Trial = namedtuple(
+    'Trial',
+    ('failures', 'outages', 'overlaps', 'centuries', 'mean_neighbors')
+)
+
+
+def ring_replicas(num_nodes, vnodes, rf, strategy='rack', rng=np.random):
+    """ The replicas of every token range of a random token ring
+
+    Every node owns vnodes random tokens. The replicas of a range are its
+    owner and the next owners clockwise on the ring, skipping nodes that
+    are already replicas (SimpleStrategy) or in a rack that already has a
+    replica (rack aware, with node i in rack i % rf).
+
+    :returns: A (num_nodes * vnodes, rf) array of node indices
+    """
+    if num_nodes < rf:
+        raise ValueError('Need at least rf={0} nodes'.format(rf))
+    owners = np.repeat(np.arange(num_nodes), vnodes)
+    owners = owners[np.argsort(rng.random_sample(len(owners)))]
+    size = len(owners)
+    replicas = np.empty((size, rf), dtype=np.int64)
+    replicas[:, 0] = owners
+    filled = np.ones(size, dtype=np.int64)
+    group = owners % rf if strategy == 'rack' else owners
+    rows = np.arange(size)
+    offset = 1
+    while len(rows) and offset < size:
+        candidates = owners[(rows + offset) % size]
+        chosen = replicas[rows]
+        chosen_group = chosen % rf if strategy == 'rack' else chosen
+        taken = (
+            (chosen_group == group[(rows + offset) % size][:, None]) &
+            (np.arange(rf) < filled[rows][:, None])
+        ).any(axis=1)
+        fresh = rows[~taken]
+        replicas[fresh, filled[fresh]] = candidates[~taken]
+        filled[fresh] += 1
+        rows = rows[filled[rows] < rf]
+        offset += 1
+    return replicas
+
+
+def neighbor_keys(replicas, num_nodes):
+    """ Sorted unique keys a * num_nodes + b of neighbors a < b """
+    rf = replicas.shape[1]
+    keys = []
+    for i in range(rf):
+        for j in range(i + 1, rf):
+            a, b = replicas[:, i], replicas[:, j]
+            keys.append(np.minimum(a, b) * num_nodes + np.maximum(a, b))
+    return np.unique(np.concatenate(keys))
+
+
+def neighbor_counts(keys, num_nodes):
+    """ How many neighbors each node has """
+    return (
+        np.bincount(keys // num_nodes, minlength=num_nodes) +
+        np.bincount(keys % num_nodes, minlength=num_nodes)
+    )
+
+
+def failure_times(num_nodes, rate_in_seconds, horizon_s, rng=np.random):
+    """ The (sorted times, nodes) of every failure over the horizon """
+    counts = rng.poisson(rate_in_seconds * horizon_s, num_nodes)
+    nodes = np.repeat(np.arange(num_nodes), counts)
+    times = rng.random_sample(len(nodes)) * horizon_s
+    order = np.argsort(times)
+    return times[order], nodes[order]
+
+
+def count_outages(times, nodes, keys, num_nodes, recovery_s):
+    """ Count failures that happen while a neighbor is recovering
+
+    :param recovery_s: How long each node takes to recover once failed
+    :returns: (outages, overlaps) where outages is the number of failures
+        that hit at least one recovering neighbor and overlaps the number of
+        (recovering neighbor, failure) pairs
+    """
+    # Earlier failures that might still be recovering, found with one
+    # searchsorted; usually there are none or one in the window
+    low = np.searchsorted(times, times - recovery_s.max(), side='right')
+    depth = np.arange(len(times)) - low
+    outage = np.zeros(len(times), dtype=bool)
+    overlaps = 0
+    for d in range(1, int(depth.max()) + 1 if len(depth) else 1):
+        later = np.flatnonzero(depth >= d)
+        earlier = later - d
+        a, b = nodes[earlier], nodes[later]
+        key = np.minimum(a, b) * num_nodes + np.maximum(a, b)
+        found = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+        hit = (
+            (keys[found] == key) &
+            (times[later] - times[earlier] < recovery_s[a])
+        )
+        overlaps += int(hit.sum())
+        outage[later[hit]] = True
+    return int(outage.sum()), overlaps
+
+
+def simulate_trial(num_nodes, vnodes, rf, failure_rate_per_century,
+                   node_dataset_mb, bw_in, bw_out, strategy='rack',
+                   recovery='streaming', centuries=100, seed=0):
+    """ Simulate one random cluster for centuries, see simulate """
+    rng = np.random.RandomState(seed)
+    keys = neighbor_keys(
+        ring_replicas(num_nodes, vnodes, rf, strategy, rng), num_nodes
+    )
+    neighbors = neighbor_counts(keys, num_nodes)
+    recovery_s = np.broadcast_to(recovery_seconds(
+        node_dataset_mb, bw_in, bw_out, neighbors, recovery
+    ), neighbors.shape)
+    times, nodes = failure_times(
+        num_nodes, failure_rate_per_century / CENTURY_SECONDS,
+        centuries * CENTURY_SECONDS, rng
+    )
+    outages, overlaps = count_outages(
+        times, nodes, keys, num_nodes, recovery_s
+    )
+    return Trial(len(times), outages, overlaps, centuries, neighbors.mean())
+
+
+def _run_trial(kwargs):
+    return simulate_trial(**kwargs)
+
+
+def simulate(num_nodes, vnodes, rf, failure_rate_per_century,
+             node_dataset_mb, bw_in, bw_out, strategy='rack',
+             recovery='streaming', centuries=100, trials=8, jobs=None,
+             seed=0):
+    """ Estimate outages per century and compare them with the model
+
+    Each trial builds its own random ring and runs for centuries, trials
+    run in parallel across jobs processes (1 runs them inline).
+
+    :returns: A dict of the simulated and predicted outages per century and
+        neighbor counts, and the individual trials
+    """
+    seeds = [
+        int(s.generate_state(1)[0])
+        for s in np.random.SeedSequence(seed).spawn(trials)
+    ]
+    kwargs = [
+        dict(num_nodes=num_nodes, vnodes=vnodes, rf=rf,
+             failure_rate_per_century=failure_rate_per_century,
+             node_dataset_mb=node_dataset_mb, bw_in=bw_in, bw_out=bw_out,
+             strategy=strategy, recovery=recovery, centuries=centuries,
+             seed=s)
+        for s in seeds
+    ]
+    if jobs == 1:
+        results = [_run_trial(k) for k in kwargs]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_run_trial, kwargs))
+
+    rates = np.array([t.outages / float(t.centuries) for t in results])
+    return {
+        'outages_per_century': rates.mean(),
+        'outages_per_century_stderr': (
+            rates.std(ddof=1) / np.sqrt(len(rates)) if len(rates) > 1
+            else float('nan')
+        ),
+        'predicted_outages_per_century': outages_per_century(
+            vnodes, failure_rate_per_century, num_nodes, rf,
+            node_dataset_mb, bw_in, bw_out, strategy, recovery
+        ),
+        'mean_neighbors': np.mean([t.mean_neighbors for t in results]),
+        'predicted_neighbors': num_neighbors(num_nodes, vnodes, rf, strategy),
+        'trials': [t._asdict() for t in results],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulate Cassandra outages and compare to the model'
+    )
+    parser.add_argument('--nodes', type=int, default=96)
+    parser.add_argument('--vnodes', type=int, default=256)
+    parser.add_argument('--rf', type=int, default=3)
+    parser.add_argument('--strategy', choices=('rack', 'simple'),
+                        default='rack')
+    parser.add_argument('--recovery', choices=('streaming', 'ebs'),
+                        default='streaming')
+    parser.add_argument('--failures-per-century', type=float, default=25)
+    parser.add_argument('--dataset-mb', type=float, default=300 * 1024)
+    parser.add_argument('--bw-in', type=float, default=125,
+                        help='Inbound streaming MB/s')
+    parser.add_argument('--bw-out', type=float, default=25 / 2.,
+                        help='Outbound streaming MB/s')
+    parser.add_argument('--centuries', type=float, default=100)
+    parser.add_argument('--trials', type=int, default=8)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    result = simulate(
+        args.nodes, args.vnodes, args.rf, args.failures_per_century,
+        args.dataset_mb, args.bw_in, args.bw_out, strategy=args.strategy,
+        recovery=args.recovery, centuries=args.centuries,
+        trials=args.trials, jobs=args.jobs, seed=args.seed
+    )
+    print(json.dumps(result, indent=2, default=float))
+
+
+if __name__ == '__main__':
+    main()
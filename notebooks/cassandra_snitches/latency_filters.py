@@ -0,0 +1,511 @@
+""" Online latency filters for dynamic snitch style replica scoring
+
+Every filter is fed one latency at a time with sample(value) and asked for
+its current score with measure(), like the filters in
+snitch_lpf_comparison.ipynb, but without copying or sorting the window on
+every sample:
+
+* EMA: an exponential moving average, O(1)
+* WindowedQuantile: any quantile (MedianFilter for the median) of the last
+  size samples, kept in a ring buffer and two heaps, O(log size)
+* DecayingReservoir: a forward decaying priority sample like Codahale's
+  ExponentiallyDecayingReservoir, which Cassandra's DES historically used,
+  O(log size) per sample
+
+run(values) feeds a whole array and returns the score after every sample,
+which EMA and WindowedQuantile compute in bulk with NumPy. LatencyGenerator
+draws the notebook's multi-mode latency model in blocks. Run this file to
+benchmark the throughput of every filter.
+"""
+import abc
+import argparse
+import heapq
+import math
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class LatencyFilter(abc.ABC):
+    """ A filter over a stream of latencies """
+
+    @abc.abstractmethod
+    def sample(self, value):
+        """ Add a latency to the filter """
+
+    @abc.abstractmethod
+    def measure(self):
+        """ The current score of the filter """
+
+    def run(self, values):
+        """ Sample every value, returning the measure after each one """
+        result = np.empty(len(values))
+        sample, measure = self.sample, self.measure
+        for i, value in enumerate(np.asarray(values).tolist()):
+            sample(value)
+            result[i] = measure()
+        return result
+
+
+class EMA(LatencyFilter):
+    """ An exponential moving average
+
+    :param alpha1: The weight of every new sample
+    :param initial: The value before any samples
+    """
+
+    def __init__(self, alpha1, initial):
+        self._ema_1 = initial
+        self.alpha1 = alpha1
+
+    def sample(self, value):
+        self._ema_1 = self.alpha1 * value + (1 - self.alpha1) * self._ema_1
+
+    def measure(self):
+        return self._ema_1
+
+    def run(self, values):
+        """ The EMA after every value, a block of samples at a time
+
+        Within a block y[j] = d^(j+1) * (y[-1] + alpha * sum(d^-(k+1) x[k]))
+        for k <= j, with d = 1 - alpha, which is one cumsum. Blocks are
+        short enough that d^-(k+1) can't overflow.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        result = np.empty(len(values))
+        decay = 1.0 - self.alpha1
+        if decay <= 0.0 or not len(values):
+            result[:] = values
+            if len(values):
+                self._ema_1 = float(values[-1])
+            return result
+        block = max(1, min(1024, int(460 / -math.log(decay))))
+        powers = decay ** np.arange(1, block + 1)
+        ema = float(self._ema_1)
+        for start in range(0, len(values), block):
+            chunk = values[start:start + block]
+            scale = powers[:len(chunk)]
+            result[start:start + len(chunk)] = scale * (
+                ema + self.alpha1 * np.cumsum(chunk / scale)
+            )
+            ema = result[start + len(chunk) - 1]
+        self._ema_1 = float(ema)
+        return result
+
+
+class WindowedQuantile(LatencyFilter):
+    """ A quantile of the last size samples
+
+    The window lives in a ring buffer. The samples at or below the quantile
+    are in a max heap and the rest in a min heap, so measure() is the top
+    of the lower heap. Samples that leave the window are deleted lazily
+    when they reach the top of their heap, and the heaps are rebuilt once
+    they hold as many expired samples as live ones, which keeps sample()
+    O(log size) amortized.
+
+    measure() returns sorted(window)[int(quantile * len(window))], the same
+    element MedianFilter in the notebook picked for the median.
+
+    :param size: How many of the latest samples to keep
+    :param quantile: Which quantile of them to measure
+    :param initial: What measure() returns before any samples
+    """
+
+    def __init__(self, size, quantile=0.5, initial=None):
+        if size < 1:
+            raise ValueError('size must be positive, got {0}'.format(size))
+        if not 0 <= quantile <= 1:
+            raise ValueError('quantile must be in [0, 1], got {0}'.format(
+                quantile))
+        self.size = size
+        self.quantile = quantile
+        self.initial = initial
+        self.reset()
+
+    def reset(self):
+        # (-value, -seq) at or below the quantile and (value, seq) above it,
+        # seq makes equal values distinct so expired ones can be found
+        self._lower = []
+        self._upper = []
+        self._lower_size = 0
+        self._upper_size = 0
+        self._expired = set()
+        self._ring = [None] * self.size
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def _rank(self, n):
+        return min(int(self.quantile * n), n - 1)
+
+    def _lower_top(self):
+        lower, expired = self._lower, self._expired
+        while lower and -lower[0][1] in expired:
+            expired.discard(-heapq.heappop(lower)[1])
+        return (-lower[0][0], -lower[0][1]) if lower else None
+
+    def _upper_top(self):
+        upper, expired = self._upper, self._expired
+        while upper and upper[0][1] in expired:
+            expired.discard(heapq.heappop(upper)[1])
+        return upper[0] if upper else None
+
+    def sample(self, value):
+        seq = self.count
+        self.count += 1
+        slot = seq % self.size
+        old = self._ring[slot]
+        if old is not None:
+            top = self._lower_top()
+            if top is not None and old <= top:
+                self._lower_size -= 1
+            else:
+                self._upper_size -= 1
+            self._expired.add(old[1])
+        entry = (value, seq)
+        self._ring[slot] = entry
+        top = self._lower_top()
+        if top is not None and entry <= top:
+            heapq.heappush(self._lower, (-value, -seq))
+            self._lower_size += 1
+        else:
+            heapq.heappush(self._upper, entry)
+            self._upper_size += 1
+
+        target = self._rank(self._lower_size + self._upper_size) + 1
+        while self._lower_size > target:
+            moved = self._lower_top()
+            heapq.heappop(self._lower)
+            heapq.heappush(self._upper, moved)
+            self._lower_size -= 1
+            self._upper_size += 1
+        while self._lower_size < target:
+            value, seq = self._upper_top()
+            heapq.heappop(self._upper)
+            heapq.heappush(self._lower, (-value, -seq))
+            self._lower_size += 1
+            self._upper_size -= 1
+        if len(self._expired) > self.size:
+            self._compact()
+
+    def _compact(self):
+        """ Rebuild the heaps from the live samples in the ring """
+        live = sorted(entry for entry in self._ring if entry is not None)
+        self._lower = [(-v, -s) for v, s in live[:self._lower_size]]
+        heapq.heapify(self._lower)
+        # A sorted list is already a min heap
+        self._upper = live[self._lower_size:]
+        self._expired.clear()
+
+    def measure(self):
+        top = self._lower_top()
+        return self.initial if top is None else top[0]
+
+    def window(self):
+        """ The samples in the window, oldest first """
+        if self.count <= self.size:
+            entries = self._ring[:self.count]
+        else:
+            slot = self.count % self.size
+            entries = self._ring[slot:] + self._ring[:slot]
+        return np.array([value for value, _ in entries], dtype=np.float64)
+
+    def run(self, values, chunk_size=1 << 20):
+        """ The quantile after every value
+
+        Once the window is full every score is a np.partition of a sliding
+        window view, chunk_size elements at a time. That is O(size) work
+        per sample but in C, which beats the heaps for windows of a few
+        hundred samples.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        history = np.concatenate([self.window(), values])
+        start = len(history) - len(values)
+        result = np.empty(len(values))
+        # Scores before the window fills come from the heaps
+        warm = min(len(values), max(0, self.size - 1 - start))
+        for i in range(warm):
+            self.sample(float(values[i]))
+            result[i] = self.measure()
+        if warm == len(values):
+            return result
+
+        windows = sliding_window_view(history, self.size)
+        rank = self._rank(self.size)
+        rows = max(1, chunk_size // self.size)
+        first = start + warm - self.size + 1
+        for lo in range(first, len(windows), rows):
+            hi = min(lo + rows, len(windows))
+            out = lo - first + warm
+            result[out:out + hi - lo] = np.partition(
+                windows[lo:hi], rank, axis=1
+            )[:, rank]
+
+        # Rebuild the heaps from the final window, with the sequence
+        # numbers the samples would have had
+        count = self.count + len(values) - warm
+        self.reset()
+        self.count = count - self.size
+        for value in history[-self.size:].tolist():
+            self.sample(value)
+        return result
+
+
+class MedianFilter(WindowedQuantile):
+    """ The median of the last size samples, see WindowedQuantile """
+
+    def __init__(self, initial, size):
+        super(MedianFilter, self).__init__(size, 0.5, initial)
+
+
+class DecayingReservoir(LatencyFilter):
+    """ A forward decaying reservoir, like Codahale's
+    ExponentiallyDecayingReservoir
+
+    Every sample gets the priority exp(alpha * t) / u for a uniform u and
+    the size highest priorities are kept in a min heap, so recent samples
+    are exponentially more likely to be in the reservoir. Priorities are
+    rescaled every rescale_s seconds so they don't overflow. measure() is
+    the weighted quantile of the reservoir, which is cached until the
+    reservoir changes.
+
+    :param size: How many samples to keep
+    :param alpha: How fast old samples decay, per second
+    :param quantile: Which quantile to measure
+    :param rate: Samples per second, used to derive time from the sample
+        count when sample() isn't given one
+    :param seed: Seeds the Generator of the priorities
+    :param initial: What measure() returns before any samples
+    :param block_size: How many uniforms to draw at once
+    """
+
+    def __init__(self, size=100, alpha=0.015, quantile=0.5, rate=1000.0,
+                 seed=None, initial=None, rescale_s=3600.0,
+                 block_size=1 << 14):
+        self.size = size
+        self.alpha = alpha
+        self.quantile = quantile
+        self.rate = float(rate)
+        self.initial = initial
+        self.rescale_s = rescale_s
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+        self._uniforms = []
+        self._heap = []
+        self._landmark = 0.0
+        self._snapshot = None
+        self.count = 0
+
+    def _uniform(self):
+        if not self._uniforms:
+            # In (0, 1] so the priority stays finite, and reversed so pop
+            # hands them out in the order they were drawn
+            self._uniforms = (1.0 - self.rng.random(self.block_size)).tolist()
+            self._uniforms.reverse()
+        return self._uniforms.pop()
+
+    def sample(self, value, now=None):
+        """ Add value, seen at now seconds (by default count / rate) """
+        if now is None:
+            now = self.count / self.rate
+        seq = self.count
+        self.count += 1
+        if now - self._landmark >= self.rescale_s:
+            self._rescale(now)
+        weight = math.exp(self.alpha * (now - self._landmark))
+        entry = (weight / self._uniform(), seq, value, weight)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            return
+        self._snapshot = None
+
+    def _rescale(self, now):
+        factor = math.exp(-self.alpha * (now - self._landmark))
+        self._landmark = now
+        # Scaling every priority by the same factor keeps the heap order
+        self._heap = [
+            (priority * factor, seq, value, weight * factor)
+            for priority, seq, value, weight in self._heap
+        ]
+        self._snapshot = None
+
+    def measure(self):
+        if not self._heap:
+            return self.initial
+        if self._snapshot is None:
+            entries = sorted((value, weight)
+                             for _, _, value, weight in self._heap)
+            values = np.array([value for value, _ in entries])
+            weights = np.array([weight for _, weight in entries])
+            # The share of the weight below each value, as in Codahale's
+            # WeightedSnapshot
+            below = np.cumsum(weights) - weights
+            below /= weights.sum()
+            index = max(
+                int(np.searchsorted(below, self.quantile, side='right')) - 1, 0
+            )
+            self._snapshot = float(values[index])
+        return self._snapshot
+
+
+class LatencyDistribution(object):
+    """ An exponential latency with the given skew truncated to
+    [minimum, maximum], like scipy.stats.truncexpon but drawn in bulk
+    """
+
+    def __init__(self, minimum, maximum, skew):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.skew = skew
+        # How much of the exponential's mass is below maximum
+        self._mass = -math.expm1(-(maximum - minimum) / float(skew))
+
+    def draw(self, rng, n):
+        """ n latencies by inverting the truncated CDF """
+        return self.minimum - self.skew * np.log1p(-rng.random(n) * self._mass)
+
+
+class LatencyGenerator(object):
+    """ Latencies from a mixture of LatencyDistribution, block_size at a time
+
+    Iterating yields max_sample values one by one, blocks() yields them as
+    arrays and draw(n) draws n more.
+
+    :param latency_ranges: A list of (LatencyDistribution, probability)
+    :param max_sample: How many latencies iterating yields
+    :param seed: Seeds the Generator
+    :param integer: Truncate latencies to whole milliseconds, as the
+        notebook did
+    """
+
+    def __init__(self, latency_ranges, max_sample, seed=None,
+                 block_size=1 << 16, integer=True):
+        self.max = max_sample
+        self.d = [d for d, _ in latency_ranges]
+        p = np.array([p for _, p in latency_ranges], dtype=np.float64)
+        self.cumulative = np.cumsum(p / p.sum())
+        self.block_size = block_size
+        self.integer = integer
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.max
+
+    def draw(self, n):
+        which = np.minimum(
+            np.searchsorted(self.cumulative, self.rng.random(n), side='right'),
+            len(self.d) - 1
+        )
+        result = np.empty(n)
+        for i, distribution in enumerate(self.d):
+            mask = which == i
+            result[mask] = distribution.draw(self.rng, int(mask.sum()))
+        if self.integer:
+            return result.astype(np.int64)
+        return result
+
+    def blocks(self):
+        for start in range(0, self.max, self.block_size):
+            yield self.draw(min(self.block_size, self.max - start))
+
+    def __iter__(self):
+        for block in self.blocks():
+            for value in block.tolist():
+                yield value
+
+
+# The replica latency model of snitch_lpf_comparison.ipynb
+CASSANDRA_LATENCY_RANGES = [
+    # Most of the requests
+    (LatencyDistribution(1, 10, 5), 0.9),
+    # Young GC
+    (LatencyDistribution(20, 30, 3), 0.0925),
+    # Segment retransmits
+    (LatencyDistribution(200, 210, 5), 0.005),
+    # Safepoint pauses
+    (LatencyDistribution(1000, 2000, 10), 0.00195),
+    # Timeouts / stuck connections / safepoint pauses
+    (LatencyDistribution(10000, 10005, 1), 0.00055)
+]
+
+
+def cassandra_latencies(n, seed=None):
+    """ n latencies (ms) of the notebook's replica latency model """
+    return LatencyGenerator(CASSANDRA_LATENCY_RANGES, n, seed).draw(n)
+
+
+def filters(window=100, alpha=0.05, initial=0.0, seed=None):
+    """ Fresh instances of every filter, by name """
+    return {
+        'ema': EMA(alpha, initial),
+        'median': MedianFilter(initial, window),
+        'p99': WindowedQuantile(window, 0.99, initial),
+        'reservoir': DecayingReservoir(window, seed=seed, initial=initial),
+    }
+
+
+def benchmark(samples=1 << 22, streaming_samples=1 << 18, window=100,
+              alpha=0.05, seed=0):
+    """ Samples per second of the generator and of every filter
+
+    Streaming feeds streaming_samples values through sample() and
+    measure() one at a time, batched feeds samples values through run().
+
+    :returns: A list of (name, mode, samples, seconds) tuples
+    """
+    results = []
+    start = time.perf_counter()
+    values = cassandra_latencies(samples, seed)
+    results.append(
+        ('generator', 'batched', samples, time.perf_counter() - start)
+    )
+    initial = float(values[0])
+    head = values[:streaming_samples].tolist()
+    for name, latency_filter in filters(window, alpha, initial, seed).items():
+        sample, measure = latency_filter.sample, latency_filter.measure
+        start = time.perf_counter()
+        for value in head:
+            sample(value)
+            measure()
+        results.append(
+            (name, 'streaming', len(head), time.perf_counter() - start)
+        )
+    for name, latency_filter in filters(window, alpha, initial, seed).items():
+        if type(latency_filter).run is LatencyFilter.run:
+            # Batched would only be the streaming loop again
+            continue
+        start = time.perf_counter()
+        latency_filter.run(values)
+        results.append(
+            (name, 'batched', samples, time.perf_counter() - start)
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the throughput of the latency filters'
+    )
+    parser.add_argument('--samples', type=int, default=1 << 22)
+    parser.add_argument('--streaming-samples', type=int, default=1 << 18)
+    parser.add_argument('--window', type=int, default=100)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('{0:<10} {1:<10} {2:>10} {3:>16}'.format(
+        'filter', 'mode', 'samples', 'samples/s'))
+    for name, mode, samples, seconds in benchmark(
+            args.samples, args.streaming_samples, args.window, args.alpha,
+            args.seed):
+        print('{0:<10} {1:<10} {2:>10} {3:>16,.0f}'.format(
+            name, mode, samples, samples / seconds))
+
+
+if __name__ == '__main__':
+    main()
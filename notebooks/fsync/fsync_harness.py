@@ -0,0 +1,348 @@
+""" Sweep fdatasync strategies and record the latency of every syscall
+
+benchmark.c only reports the total milliseconds of each trial. This harness
+runs the same loop (write block_size bytes until target_size, calling
+fdatasync every sync_interval bytes) over every combination of block size,
+target size, sync interval and open flags, timing each write and each
+fdatasync on its own. Every trial is written as one JSON line with its
+total time, a summary and log-linear histogram of the write and sync
+latencies, and the kernel and filesystem it ran on, so runs on different
+kernels can be compared:
+
+    python fsync_harness.py --path /mnt/ext4/test.bin \\
+        --sync-intervals=-1,1M,64K --variants buffered,dsync \\
+        --output results.jsonl
+
+Sync intervals follow benchmark.c's size[] table: 0 never syncs, -1 syncs
+once at the end and anything else syncs every that many bytes. A list that
+starts with -1 has to be passed with =, otherwise argparse takes it for an
+option. Like
+benchmark.c the first fdatasync comes right after the first write, then
+one each time another sync_interval bytes have been written.
+
+Each syscall is timed from Python, which adds around a microsecond to
+every sample. That is small next to a write to the page cache and
+negligible next to an fdatasync, and it is the same on every kernel.
+"""
+import argparse
+import itertools
+import json
+import mmap
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+# Extra open flags of each variant, O_DIRECT needs aligned buffers, sizes
+# and offsets, which block sizes that are a multiple of 4KiB satisfy
+O_DIRECT = getattr(os, 'O_DIRECT', None)
+O_DSYNC = getattr(os, 'O_DSYNC', None)
+VARIANTS = {
+    'buffered': 0,
+    'direct': O_DIRECT,
+    'dsync': O_DSYNC,
+    'direct+dsync': (
+        None if None in (O_DIRECT, O_DSYNC) else O_DIRECT | O_DSYNC
+    ),
+}
+# benchmark.c's size[] table
+DEFAULT_SYNC_INTERVALS = (
+    0, -1, 100 << 20, 10 << 20, 1 << 20, 512 << 10, 256 << 10, 128 << 10,
+    64 << 10, 32 << 10, 16 << 10
+)
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999, 0.9999)
+# Histogram bucket i holds latencies in [2^(i/8), 2^((i+1)/8)) ns, about 9%
+# wide, and the same everywhere so histograms of different runs line up
+BUCKETS_PER_OCTAVE = 8
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+def parse_size(value):
+    """ Parse a size such as 4096, 4K, 1M or 1GiB into bytes """
+    text = value.strip().lower()
+    if text.endswith('ib'):
+        text = text[:-2]
+    elif text.endswith('b'):
+        text = text[:-1]
+    number = text.rstrip('kmg')
+    unit = text[len(number):]
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(
+            'expected a size such as 4096, 4K or 1M, got {0}'.format(value))
+
+
+def parse_list(parse):
+    def parse_values(value):
+        return [parse(v) for v in value.split(',') if v.strip()]
+    return parse_values
+
+
+def histogram(latencies_ns):
+    """ The non empty log-linear buckets of latencies, as parallel lists """
+    index = np.floor(
+        np.log2(np.maximum(latencies_ns, 1)) * BUCKETS_PER_OCTAVE
+    ).astype(np.int64)
+    buckets, counts = np.unique(index, return_counts=True)
+    return {
+        'buckets_per_octave': BUCKETS_PER_OCTAVE,
+        'bucket': buckets.tolist(),
+        'count': counts.tolist(),
+    }
+
+
+def bucket_edges_ns(buckets, buckets_per_octave=BUCKETS_PER_OCTAVE):
+    """ The (lower, upper) nanoseconds of histogram buckets """
+    buckets = np.asarray(buckets, dtype=np.float64)
+    return (
+        np.exp2(buckets / buckets_per_octave),
+        np.exp2((buckets + 1) / buckets_per_octave)
+    )
+
+
+def summarize(latencies_ns):
+    """ Count, total, mean, min, max and quantiles (in us) and histogram """
+    if not len(latencies_ns):
+        return {'count': 0}
+    micros = latencies_ns / 1000.0
+    result = {
+        'count': len(micros),
+        'total_ms': float(micros.sum() / 1000.0),
+        'mean_us': float(micros.mean()),
+        'min_us': float(micros.min()),
+        'max_us': float(micros.max()),
+        'histogram': histogram(latencies_ns),
+    }
+    values = np.quantile(micros, SUMMARY_QUANTILES, method='inverted_cdf')
+    for quantile, value in zip(SUMMARY_QUANTILES, values):
+        result['p{0:g}_us'.format(quantile * 100)] = float(value)
+    return result
+
+
+def aligned_buffer(block_size):
+    """ block_size bytes of 'x' in an anonymous (so page aligned) mapping """
+    buf = mmap.mmap(-1, block_size)
+    buf.write(b'x' * block_size)
+    return buf
+
+
+def run_trial(path, block_size, target_size, sync_interval,
+              variant='buffered', truncate=False):
+    """ Write target_size bytes to path like benchmark.c, timing every
+    write and fdatasync
+
+    :returns: (total_ns, write latencies, sync latencies) in ns
+    """
+    flags = VARIANTS[variant]
+    if flags is None:
+        raise ValueError('{0} is not supported on this platform'.format(
+            variant))
+    flags |= os.O_RDWR | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+    num_writes = target_size // block_size
+    writes = np.empty(num_writes, dtype=np.int64)
+    syncs = []
+    buf = aligned_buffer(block_size)
+    clock = time.perf_counter_ns
+    write = os.write
+    fdatasync = os.fdatasync
+
+    fd = os.open(path, flags, 0o600)
+    try:
+        # Exactly benchmark.c's check, which also syncs after the first
+        # write, so sync counts match the C benchmark
+        written = 0
+        next_sync = 0
+        start = clock()
+        for i in range(num_writes):
+            before = clock()
+            write(fd, buf)
+            after = clock()
+            writes[i] = after - before
+            if sync_interval > 0:
+                written += block_size
+                if written > next_sync:
+                    fdatasync(fd)
+                    syncs.append(clock() - after)
+                    next_sync += sync_interval
+        if sync_interval < 0:
+            before = clock()
+            fdatasync(fd)
+            syncs.append(clock() - before)
+        total = clock() - start
+    finally:
+        os.close(fd)
+        buf.close()
+    return total, writes, np.array(syncs, dtype=np.int64)
+
+
+def filesystem(path):
+    """ The (mount point, filesystem type) path is on, from /proc/mounts """
+    path = os.path.realpath(path)
+    best = ('', 'unknown')
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                mount, fs_type = fields[1], fields[2]
+                inside = path == mount or path.startswith(
+                    mount.rstrip('/') + '/'
+                )
+                if inside and len(mount) >= len(best[0]):
+                    best = (mount, fs_type)
+    except OSError:
+        pass
+    return best
+
+
+def sweep(path, block_sizes=(4096,), target_sizes=(100 << 20,),
+          sync_intervals=DEFAULT_SYNC_INTERVALS, variants=('buffered',),
+          trials=10, truncate=False):
+    """ Yield a result dict for every trial of every combination
+
+    Combinations a filesystem refuses (e.g. O_DIRECT on tmpfs) yield a
+    single result with an error instead of trials.
+    """
+    mount, fs_type = filesystem(os.path.dirname(os.path.abspath(path)))
+    environment = {
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'path': os.path.abspath(path),
+        'mount': mount,
+        'filesystem': fs_type,
+    }
+    combinations = itertools.product(
+        variants, block_sizes, target_sizes, sync_intervals
+    )
+    for variant, block_size, target_size, sync_interval in combinations:
+        params = dict(
+            environment, variant=variant, block_size=block_size,
+            target_size=target_size, sync_interval=sync_interval
+        )
+        for trial in range(trials):
+            try:
+                total, writes, syncs = run_trial(
+                    path, block_size, target_size, sync_interval, variant,
+                    truncate
+                )
+            except (OSError, ValueError) as e:
+                yield dict(params, error=str(e))
+                break
+            yield dict(
+                params, trial=trial, total_ms=total / 1e6,
+                writes=summarize(writes), syncs=summarize(syncs)
+            )
+            # Like the sync after every make target, so dirty pages of one
+            # trial aren't flushed during the next
+            os.sync()
+
+
+def load_results(path):
+    """ The result dicts of a JSON lines file written by this harness """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fsync_data(results, field='total_ms', **params):
+    """ {sync_interval: [field of each trial]} of the results matching
+    params, the shape of the fsync_data dict in fsync_after.ipynb
+
+    field may name a nested value, e.g. fsync_data(results, 'syncs.p99_us',
+    variant='buffered', block_size=4096)
+    """
+    data = {}
+    for result in results:
+        if 'error' in result or any(
+                result.get(k) != v for k, v in params.items()):
+            continue
+        value = result
+        for key in field.split('.'):
+            value = value.get(key)
+            if value is None:
+                break
+        if value is not None:
+            data.setdefault(result['sync_interval'], []).append(value)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time every write and fdatasync over a sweep of sync '
+                    'strategies, writing one JSON line per trial',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--path', default='test.bin',
+        help=(
+            'The file to write, put it on the filesystem under test. It is '
+            'removed afterwards unless it already existed'
+        )
+    )
+    parser.add_argument(
+        '--block-sizes', type=parse_list(parse_size), default=[4096],
+        help='Comma separated write sizes, e.g. 4K,64K'
+    )
+    parser.add_argument(
+        '--target-sizes', type=parse_list(parse_size), default=[100 << 20],
+        help='Comma separated bytes to write per trial, e.g. 100M,1G'
+    )
+    parser.add_argument(
+        '--sync-intervals', type=parse_list(parse_size),
+        default=list(DEFAULT_SYNC_INTERVALS),
+        help=(
+            'Comma separated bytes between fdatasync calls, 0 never syncs '
+            'and -1 syncs once at the end. Pass lists starting with -1 as '
+            '--sync-intervals=-1,...'
+        )
+    )
+    parser.add_argument(
+        '--variants', type=parse_list(str), default=['buffered'],
+        help='Comma separated of {0}'.format(', '.join(sorted(VARIANTS)))
+    )
+    parser.add_argument('--trials', type=int, default=10)
+    parser.add_argument(
+        '--truncate', action='store_true',
+        help=(
+            'Truncate the file before every trial, by default trials '
+            'overwrite it in place like benchmark.c'
+        )
+    )
+    parser.add_argument(
+        '--output', default='-',
+        help='Append results to this JSON lines file, - for stdout'
+    )
+    args = parser.parse_args()
+    unknown = set(args.variants) - set(VARIANTS)
+    if unknown:
+        parser.error('Unknown variants {0}'.format(', '.join(unknown)))
+    if any(size <= 0 for size in args.block_sizes + args.target_sizes):
+        parser.error('Block and target sizes must be positive')
+
+    existed = os.path.exists(args.path)
+    out = sys.stdout if args.output == '-' else open(args.output, 'a')
+    try:
+        for result in sweep(
+                args.path, args.block_sizes, args.target_sizes,
+                args.sync_intervals, args.variants, args.trials,
+                args.truncate):
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+            out.flush()
+            if 'error' in result:
+                status = result['error']
+            else:
+                status = '{0:.0f} ms'.format(result['total_ms'])
+            sys.stderr.write('{0} bs={1} sync={2}: {3}\n'.format(
+                result['variant'], result['block_size'],
+                result['sync_interval'], status
+            ))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if not existed and os.path.exists(args.path):
+            os.remove(args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import abc
+
+import numpy as np
+
+
+class ArrivalProcess(abc.ABC):
+    """ Generates the gaps between requests in vectorized blocks
+
+    Subclasses implement blocks(interval_ms), a generator of numpy arrays of
+    inter-arrival times in milliseconds. interval_ms is the mean interval
+    the simulator was asked for (1000 / request_per_s), processes that have
+    their own notion of rate may scale or ignore it. Blocks are drawn from
+    np.random so the simulators' seed makes runs reproducible.
+
+    Open loop processes send requests no matter how the system is coping,
+    closed loop ones (closed = True) only send the next request of a client
+    once its previous one completed, see ClosedLoopClients.
+    """
+    closed = False
+
+    def __init__(self, block_size=1 << 16):
+        self.block_size = block_size
+
+    @abc.abstractmethod
+    def blocks(self, interval_ms):
+        """ Yield arrays of inter-arrival times in milliseconds """
+
+    def intervals(self, interval_ms):
+        """ The inter-arrival times one at a time, for simpy processes """
+        for block in self.blocks(interval_ms):
+            for gap in block.tolist():
+                yield gap
+
+    def times(self, n, interval_ms):
+        """ The arrival times of up to n requests, the first one at 0 """
+        gaps, total = [], 0
+        if n > 1:
+            for block in self.blocks(interval_ms):
+                gaps.append(block)
+                total += len(block)
+                if total >= n - 1:
+                    break
+        gaps = np.concatenate(gaps)[:n - 1] if gaps else np.zeros(0)
+        times = np.zeros(min(n, len(gaps) + 1))
+        np.cumsum(gaps, out=times[1:])
+        return times
+
+
+class PoissonArrivals(ArrivalProcess):
+    """ Memoryless arrivals (exponential gaps) at the simulator's rate """
+
+    def blocks(self, interval_ms):
+        while True:
+            yield np.random.exponential(interval_ms, self.block_size)
+
+
+class MMPPArrivals(ArrivalProcess):
+    """ A Markov modulated Poisson process, i.e. bursty traffic
+
+    The process sits in one of k states for an exponentially distributed
+    time with mean dwell_ms[s], sending Poisson arrivals at
+    rate_multipliers[s] times the simulator's rate, then moves to another
+    state. Without a transition matrix states are visited in order
+    (0, 1, ..., k - 1, 0, ...), so the default alternates between a quiet
+    state and a burst at four times the rate. The long run rate is the
+    dwell weighted average of the state rates, not the simulator's rate.
+
+    :param rate_multipliers: The rate of each state relative to the
+        simulator's request_per_s
+    :param dwell_ms: The mean time spent in each state
+    :param transitions: An optional k x k matrix of state transition
+        probabilities
+    """
+
+    def __init__(self, rate_multipliers=(0.5, 4.0), dwell_ms=(1000.0, 100.0),
+                 transitions=None, block_size=1 << 16):
+        super(MMPPArrivals, self).__init__(block_size)
+        self.rate_multipliers = np.asarray(rate_multipliers, dtype=float)
+        self.dwell_ms = np.asarray(dwell_ms, dtype=float)
+        k = len(self.rate_multipliers)
+        if transitions is None:
+            transitions = np.roll(np.eye(k), 1, axis=1)
+        self.cumulative = np.cumsum(np.asarray(transitions, float), axis=1)
+
+    def states(self, state, count):
+        """ The next count states of the chain after state """
+        result = np.empty(count, dtype=np.int64)
+        draws = np.random.random_sample(count)
+        for i in range(count):
+            state = min(
+                int(np.searchsorted(self.cumulative[state], draws[i])),
+                len(self.rate_multipliers) - 1
+            )
+            result[i] = state
+        return result
+
+    def blocks(self, interval_ms):
+        state, t_last = 0, 0.0
+        t_state = 0.0
+        # Enough state visits per block to produce about block_size arrivals
+        mean_rate = (
+            (self.rate_multipliers * self.dwell_ms).sum() /
+            self.dwell_ms.sum() / interval_ms
+        )
+        visits = max(
+            int(self.block_size / (mean_rate * self.dwell_ms.mean())), 1
+        )
+        while True:
+            states = np.r_[state, self.states(state, visits - 1)]
+            durations = np.random.exponential(self.dwell_ms[states])
+            starts = t_state + np.r_[0.0, np.cumsum(durations)[:-1]]
+            counts = np.random.poisson(
+                durations * self.rate_multipliers[states] / interval_ms
+            )
+            # Given the count, Poisson arrivals are uniform over the visit
+            times = np.sort(
+                np.repeat(starts, counts) +
+                np.random.random_sample(counts.sum()) *
+                np.repeat(durations, counts)
+            )
+            state = self.states(states[-1], 1)[0]
+            t_state = starts[-1] + durations[-1]
+            if len(times):
+                yield np.diff(np.r_[t_last, times])
+                t_last = times[-1]
+
+
+class DiurnalArrivals(ArrivalProcess):
+    """ Poisson arrivals whose rate follows a sine wave, e.g. a daily cycle
+
+    The rate at time t is the simulator's rate times
+    1 + amplitude * sin(2 * pi * t / period_ms), generated by thinning a
+    Poisson process at the peak rate.
+
+    :param period_ms: The length of one cycle
+    :param amplitude: How far the rate swings either way, in [0, 1]
+    """
+
+    def __init__(self, period_ms=60000.0, amplitude=0.5, block_size=1 << 16):
+        super(DiurnalArrivals, self).__init__(block_size)
+        self.period_ms = period_ms
+        self.amplitude = amplitude
+
+    def blocks(self, interval_ms):
+        peak = 1 + self.amplitude
+        t, t_last = 0.0, 0.0
+        while True:
+            candidates = t + np.cumsum(
+                np.random.exponential(interval_ms / peak, self.block_size)
+            )
+            t = candidates[-1]
+            rate = 1 + self.amplitude * np.sin(
+                2 * np.pi * candidates / self.period_ms
+            )
+            times = candidates[
+                np.random.random_sample(self.block_size) * peak < rate
+            ]
+            if len(times):
+                yield np.diff(np.r_[t_last, times])
+                t_last = times[-1]
+
+
+class TraceArrivals(ArrivalProcess):
+    """ Replay the arrival times of a recorded trace
+
+    :param times: Arrival times in milliseconds, or the path of a text file
+        with one per line
+    :param speedup: Replay the trace this many times faster
+    :param loop: Start the trace over when it runs out, otherwise the
+        simulation ends with the trace
+    """
+
+    def __init__(self, times, speedup=1.0, loop=False, block_size=1 << 16):
+        super(TraceArrivals, self).__init__(block_size)
+        if isinstance(times, str):
+            times = np.loadtxt(times, dtype=np.float64, ndmin=1)
+        times = np.sort(np.asarray(times, dtype=np.float64))
+        self.gaps = np.diff(times) / speedup
+        self.loop = loop
+
+    def blocks(self, interval_ms):
+        if not len(self.gaps):
+            return
+        while True:
+            for start in range(0, len(self.gaps), self.block_size):
+                yield self.gaps[start:start + self.block_size]
+            if not self.loop:
+                return
+            # The gap between the end of one pass and the next start
+            yield self.gaps[:1]
+
+
+class ClosedLoopClients(ArrivalProcess):
+    """ A fixed number of clients that each wait for their last response
+
+    Each client sends a request, waits for it to complete and then thinks
+    for an exponentially distributed time (mean think_time_ms, 0 for none)
+    before sending the next one, like a load generator with a fixed
+    concurrency. The simulator's request_per_s is ignored.
+
+    :param clients: How many requests can be outstanding at once
+    :param think_time_ms: The mean time between a response and the next
+        request of a client
+    """
+    closed = True
+
+    def __init__(self, clients=16, think_time_ms=0.0, block_size=1 << 16):
+        super(ClosedLoopClients, self).__init__(block_size)
+        self.clients = clients
+        self.think_time_ms = think_time_ms
+
+    def blocks(self, interval_ms):
+        while True:
+            if self.think_time_ms:
+                yield np.random.exponential(
+                    self.think_time_ms, self.block_size
+                )
+            else:
+                yield np.zeros(self.block_size)
+
+
+def open_loop_times(arrival_process, n, interval_ms):
+    """ Arrival times for the vectorized engines, which can't close the loop
+    """
+    if arrival_process is None:
+        arrival_process = PoissonArrivals()
+    if arrival_process.closed:
+        raise ValueError(
+            'Closed loop arrivals need a simpy simulator, e.g. '
+            'request_simulator'
+        )
+    return arrival_process.times(n, interval_ms)
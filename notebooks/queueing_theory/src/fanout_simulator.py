@@ -0,0 +1,279 @@
+import heapq
+import itertools
+import random
+
+import numpy as np
+
+from arrivals import open_loop_times
+from fast_simulator import grouped_fifo_starts
+from hedging_simulator import Worker
+from latency_distributions import seed_latency_fn
+from latency_recorder import from_columns
+from latency_recorder import LatencyRecorder
+from lb_policies import random_lb
+from lb_policies import rr_lb
+from lb_state import lb_hooks
+
+COORDINATOR_DONE, REPLICA_DONE = range(2)
+
+
+class Tier(object):
+    """ A tier of FIFO workers behind a load balancer, for the event loop """
+
+    def __init__(self, worker_desc, load_balancer, latency_fn, done):
+        count, self.capacity = worker_desc
+        self.workers = [Worker(i) for i in range(count)]
+        self.load_balancer = load_balancer
+        self.latency_fn = latency_fn
+        self.done = done
+        self.enqueue, self.dequeue = lb_hooks(load_balancer, count)
+
+    def send(self, events, sequence, request, idx, now):
+        worker = self.workers[idx]
+        if self.enqueue:
+            self.enqueue(idx)
+        if worker.count < self.capacity:
+            self.start(events, sequence, request, worker, now, now)
+        else:
+            worker.queue.append((request, now))
+
+    def start(self, events, sequence, request, worker, t_arrive, now):
+        worker.count += 1
+        t_processing = self.latency_fn(request, worker)
+        heapq.heappush(events, (
+            now + t_processing, next(sequence), self.done,
+            (request, worker.index, t_arrive, now)
+        ))
+
+    def finish(self, events, sequence, idx, now):
+        worker = self.workers[idx]
+        if self.dequeue:
+            self.dequeue(idx)
+        worker.count -= 1
+        if worker.queue and worker.count < self.capacity:
+            request, t_arrive = worker.queue.popleft()
+            self.start(events, sequence, request, worker, t_arrive, now)
+
+
+class FanoutSimulator(object):
+    """ Simulates scatter-gather requests over a coordinator and replica tier
+
+    Every request is queued and processed on a coordinator, which then sends
+    it to fanout replicas and completes once wait_for of them respond, like
+    a Cassandra coordinator reading at QUORUM. The replica load balancer
+    picks the first replica and the rest are the next workers in order,
+    like replicas on a token ring. Responses after the first wait_for are
+    still processed (and load the replicas), they just don't count.
+
+    With rr_lb or random_lb in both tiers the queues are solved in bulk with
+    the Lindley recursion, which handles tens of millions of requests.
+    Queue aware load balancers from lb_policies or lb_state need to see
+    every queue as requests arrive, so they run through an event loop.
+
+    In data t_queued is the time spent queued on the coordinator plus on
+    the replica whose response completed the request, t_processing the rest
+    of t_total and worker that replica.
+
+    :param replica_desc: A tuple of (count, capacity) of the replica workers
+    :param replica_lb: The load balancer picking the first replica
+    :param latency_fn: A function which takes the request number and the
+        replica worker and returns the milliseconds a replica takes
+    :param number_of_requests: The number of requests to run through the
+        simulator
+    :param request_per_s: The rate of requests per second.
+    :param fanout: How many replicas each request is sent to
+    :param wait_for: How many replica responses complete a request
+    :param coordinator_desc: A tuple of (count, capacity) of the coordinator
+        workers, None to send requests straight to the replicas
+    :param coordinator_lb: The load balancer picking the coordinator
+    :param coordinator_latency_fn: Like latency_fn for coordinators,
+        defaults to no processing time
+    :param seed: What random and np.random are seeded with before simulating
+    :param arrival_process: An open loop ArrivalProcess from arrivals,
+        defaults to Poisson arrivals at request_per_s
+    """
+
+    def __init__(
+            self, replica_desc, replica_lb, latency_fn,
+            number_of_requests, request_per_s, fanout=3, wait_for=2,
+            coordinator_desc=None, coordinator_lb=rr_lb,
+            coordinator_latency_fn=None, seed=1, arrival_process=None):
+        if not 1 <= wait_for <= fanout <= replica_desc[0]:
+            raise ValueError(
+                'Need 1 <= wait_for <= fanout <= replicas, got {0} of {1} '
+                'over {2}'.format(wait_for, fanout, replica_desc[0])
+            )
+        self.replica_desc = replica_desc
+        self.replica_lb = replica_lb
+        self.latency_fn = latency_fn
+        self.number_of_requests = int(number_of_requests)
+        self.request_interval_ms = 1. / (request_per_s / 1000.)
+        self.fanout = fanout
+        self.wait_for = wait_for
+        self.coordinator_desc = coordinator_desc
+        self.coordinator_lb = coordinator_lb
+        if coordinator_latency_fn is None:
+            coordinator_latency_fn = no_latency
+        self.coordinator_latency_fn = coordinator_latency_fn
+        self.seed = seed
+        self.arrival_process = arrival_process
+        self.data = LatencyRecorder().to_array()
+
+    def simulate(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        seed_latency_fn(self.latency_fn, self.seed)
+        seed_latency_fn(self.coordinator_latency_fn, self.seed + 1)
+
+        arrivals = open_loop_times(
+            self.arrival_process, self.number_of_requests,
+            self.request_interval_ms
+        )
+        bulk = (rr_lb, random_lb)
+        if (self.replica_lb in bulk and (self.coordinator_desc is None or
+                                         self.coordinator_lb in bulk)):
+            self.data = self.simulate_bulk(arrivals)
+        else:
+            self.data = self.simulate_events(arrivals)
+
+    def simulate_bulk(self, arrivals):
+        n = len(arrivals)
+        requests = np.arange(n)
+        t_coordinated, t_queued = arrivals, np.zeros(n)
+        if self.coordinator_desc is not None:
+            count, cap = self.coordinator_desc
+            assignment = assign(self.coordinator_lb, requests, count)
+            services = service_times(
+                self.coordinator_latency_fn, requests, assignment, count
+            )
+            starts = grouped_fifo_starts(arrivals, services, assignment, cap)
+            t_queued = starts - arrivals
+            t_coordinated = starts + services
+
+        count, cap = self.replica_desc
+        # Each request's replicas are consecutive workers on the ring
+        replicas = (
+            assign(self.replica_lb, requests, count)[:, None] +
+            np.arange(self.fanout)
+        ) % count
+        replicas = replicas.ravel()
+        sub_requests = np.repeat(requests, self.fanout)
+        sub_arrivals = np.repeat(t_coordinated, self.fanout)
+        services = service_times(
+            self.latency_fn, sub_requests, replicas, count
+        )
+        starts = grouped_fifo_starts(sub_arrivals, services, replicas, cap)
+        t_done = (starts + services).reshape(n, self.fanout)
+
+        # The wait_for-th response, without sorting every request's replies
+        k = self.wait_for - 1
+        which = np.argpartition(t_done, k, axis=1)[:, k]
+        sub = requests * self.fanout + which
+        t_total = t_done[requests, which] - arrivals
+        t_queued = t_queued + starts[sub] - sub_arrivals[sub]
+        return from_columns(
+            t_queued, t_total - t_queued, t_total, replicas[sub], requests
+        )
+
+    def simulate_events(self, arrivals):
+        events = []
+        sequence = itertools.count()
+        replicas = Tier(
+            self.replica_desc, self.replica_lb, self.latency_fn, REPLICA_DONE
+        )
+        coordinators = None
+        if self.coordinator_desc is not None:
+            coordinators = Tier(
+                self.coordinator_desc, self.coordinator_lb,
+                self.coordinator_latency_fn, COORDINATOR_DONE
+            )
+        count = len(replicas.workers)
+        recorder = LatencyRecorder()
+        # How many replicas have responded, and the coordinator queue time
+        responses = {}
+        coordinator_queued = {}
+
+        def fan_out(request, now):
+            first = replicas.load_balancer(request, replicas.workers)
+            for j in range(self.fanout):
+                replicas.send(
+                    events, sequence, request, (first + j) % count, now
+                )
+            responses[request] = 0
+
+        n = len(arrivals)
+        arrivals_list = arrivals.tolist()
+        i = 0
+        while i < n or events:
+            if i < n and (not events or arrivals_list[i] <= events[0][0]):
+                now = arrivals_list[i]
+                if coordinators is None:
+                    coordinator_queued[i] = 0.0
+                    fan_out(i, now)
+                else:
+                    coordinators.send(
+                        events, sequence, i,
+                        coordinators.load_balancer(i, coordinators.workers),
+                        now
+                    )
+                i += 1
+                continue
+            now, _, kind, (request, idx, t_arrive, t_start) = heapq.heappop(
+                events
+            )
+            if kind == COORDINATOR_DONE:
+                coordinators.finish(events, sequence, idx, now)
+                coordinator_queued[request] = t_start - t_arrive
+                fan_out(request, now)
+                continue
+            replicas.finish(events, sequence, idx, now)
+            responses[request] += 1
+            if responses[request] == self.wait_for:
+                t_total = now - arrivals_list[request]
+                t_queued = coordinator_queued.pop(request) + t_start - t_arrive
+                recorder.record(
+                    t_queued, t_total - t_queued, t_total, idx, request
+                )
+            if responses[request] == self.fanout:
+                del responses[request]
+
+        data = recorder.to_array()
+        return data[np.argsort(data.request_id, kind='stable')]
+
+
+def no_latency(request, worker=None):
+    return 0.0
+
+
+def assign(load_balancer, requests, count):
+    """ Worker indices for rr_lb or random_lb, vectorized """
+    if load_balancer is rr_lb:
+        return requests % count
+    return np.random.randint(0, count, len(requests))
+
+
+def service_times(latency_fn, requests, assignment, count):
+    sample = getattr(latency_fn, 'sample', None)
+    if sample is not None and not latency_fn.worker_dependent:
+        return np.asarray(sample(len(requests)), dtype=np.float64)
+    workers = [Worker(i) for i in range(count)]
+    return np.fromiter(
+        (latency_fn(r, workers[w])
+         for r, w in zip(requests.tolist(), assignment.tolist())),
+        dtype=np.float64, count=len(requests)
+    )
+
+
+def run_fanout(
+        replica_desc, replica_lb, num_requests, request_per_s, latency_fn,
+        fanout=3, wait_for=2, coordinator_desc=None, coordinator_lb=rr_lb,
+        coordinator_latency_fn=None, seed=1, arrival_process=None):
+    simulator = FanoutSimulator(
+        replica_desc, replica_lb, latency_fn, num_requests, request_per_s,
+        fanout=fanout, wait_for=wait_for, coordinator_desc=coordinator_desc,
+        coordinator_lb=coordinator_lb,
+        coordinator_latency_fn=coordinator_latency_fn, seed=seed,
+        arrival_process=arrival_process
+    )
+    simulator.simulate()
+    return simulator.data
@@ -0,0 +1,215 @@
+import heapq
+import random
+from collections import namedtuple
+
+import numpy as np
+
+from arrivals import open_loop_times
+from latency_distributions import seed_latency_fn
+from latency_recorder import from_columns
+from latency_recorder import LatencyRecorder
+from lb_state import lb_hooks
+from lb_state import ShortestQueue
+from lb_state import StatefulBalancer
+from lb_policies import random_lb
+from lb_policies import rr_lb
+from lb_policies import shortest_queue_lb
+
+# Stands in for the simpy.Resource that a latency_fn is handed
+Worker = namedtuple('Worker', ('index', 'zone'))
+
+
+class FastRequestSimulator(object):
+    """ Simulates the same M/G/k processes as RequestSimulator without simpy
+
+    Only FIFO workers behind the round robin, random and join shortest queue
+    load balancers (or the stateful balancers of lb_state) are supported,
+    which lets us pre-draw every inter-arrival time with numpy and compute
+    when each request starts rather than stepping through simpy processes.
+    Single capacity workers fed by round robin or random are solved with the
+    Lindley recursion in numpy, larger capacities and queue aware balancers
+    use a heap based event loop.
+
+    :param worker_desc: A tuple of (count, capacity) to construct workers with
+    :param load_balancer: One of rr_lb, random_lb or shortest_queue_lb from
+        lb_policies, or a StatefulBalancer from lb_state
+    :param latency_fn: A function which takes the curent
+        request number and the worker that was assigned by the load balancer
+        amd returns the number of milliseconds a request took to process
+    :param number_of_requests: The number of requests to run through the
+        simulator
+    :param request_per_s: The rate of requests per second.
+    :param seed: What random and np.random are seeded with before simulating
+    :param arrival_process: An open loop ArrivalProcess from arrivals,
+        defaults to Poisson arrivals at request_per_s. Closed loop clients
+        depend on when requests finish, use request_simulator for those
+    """
+
+    def __init__(
+            self, worker_desc, load_balancer, latency_fn,
+            number_of_requests, request_per_s, seed=1,
+            arrival_process=None):
+        if not (load_balancer in (rr_lb, random_lb, shortest_queue_lb) or
+                isinstance(load_balancer, StatefulBalancer)):
+            raise ValueError(
+                'The fast simulator only supports rr_lb, random_lb, '
+                'shortest_queue_lb and lb_state balancers, use '
+                'request_simulator for {0}'.format(
+                    getattr(load_balancer, '__name__', load_balancer)))
+        self.worker_desc = worker_desc
+        self.load_balancer = load_balancer
+        self.latency_fn = latency_fn
+        self.number_of_requests = int(number_of_requests)
+        self.request_interval_ms = 1. / (request_per_s / 1000.)
+        self.seed = seed
+        if arrival_process is not None and arrival_process.closed:
+            raise ValueError(
+                'The fast simulator needs open loop arrivals, use '
+                'request_simulator for closed loop clients'
+            )
+        self.arrival_process = arrival_process
+        self.data = LatencyRecorder().to_array()
+
+    def simulate(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        seed_latency_fn(self.latency_fn, self.seed)
+
+        count, cap = self.worker_desc
+        self.workers = [Worker(i, "abc"[i % 3]) for i in range(count)]
+
+        # The first request arrives at t=0 just like in the simpy engine,
+        # a replayed trace may run out before number_of_requests
+        arrivals = open_loop_times(
+            self.arrival_process, self.number_of_requests,
+            self.request_interval_ms
+        )
+        n = len(arrivals)
+
+        if self.load_balancer is shortest_queue_lb:
+            starts, services, assignment = self.dispatch(
+                arrivals, cap, ShortestQueue()
+            )
+        elif isinstance(self.load_balancer, StatefulBalancer):
+            starts, services, assignment = self.dispatch(
+                arrivals, cap, self.load_balancer
+            )
+        else:
+            if self.load_balancer is rr_lb:
+                assignment = np.arange(n) % count
+            else:
+                assignment = np.random.randint(0, count, n)
+            services = self.service_times(assignment)
+            starts = grouped_fifo_starts(
+                arrivals, services, assignment, cap
+            )
+
+        t_queued = starts - arrivals
+        self.data = from_columns(
+            t_queued, services, t_queued + services, assignment,
+            np.arange(n)
+        )
+
+    def service_times(self, assignment):
+        # Latencies that don't depend on the worker can be drawn in bulk
+        sample = getattr(self.latency_fn, 'sample', None)
+        if sample is not None and not self.latency_fn.worker_dependent:
+            return np.asarray(sample(len(assignment)), dtype=np.float64)
+        workers = self.workers
+        return np.fromiter(
+            (self.latency_fn(i, workers[w])
+             for i, w in enumerate(assignment.tolist())),
+            dtype=np.float64, count=len(assignment)
+        )
+
+    def dispatch(self, arrivals, cap, load_balancer):
+        """ Send requests one at a time through a stateful load balancer
+
+        Requests that finished before an arrival are dequeued from the
+        balancer first, so like queue_size in lb_policies it sees every
+        request a worker is queueing or processing.
+        """
+        workers = self.workers
+        enqueue, dequeue = lb_hooks(load_balancer, len(workers))
+        free = [[0.0] * cap for _ in workers]
+        # (t_done, worker) of every outstanding request
+        completions = []
+        starts = np.empty_like(arrivals)
+        services = np.empty_like(arrivals)
+        assignment = np.empty(len(arrivals), dtype=np.int32)
+        for i, t_arrive in enumerate(arrivals.tolist()):
+            while completions and completions[0][0] <= t_arrive:
+                dequeue(heapq.heappop(completions)[1])
+            idx = load_balancer(i, workers)
+            t_processing = self.latency_fn(i, workers[idx])
+            servers = free[idx]
+            t_start = max(t_arrive, servers[0])
+            heapq.heapreplace(servers, t_start + t_processing)
+            heapq.heappush(completions, (t_start + t_processing, idx))
+            enqueue(idx)
+            starts[i], services[i] = t_start, t_processing
+            assignment[i] = idx
+        return starts, services, assignment
+
+
+def lindley_starts(arrivals, services):
+    """ Start times of a single FIFO server, vectorized
+
+    The Lindley recursion start[j] = max(arrive[j], start[j-1] + s[j-1])
+    unrolls to start[j] = S[j] + max(arrive[m] - S[m] for m <= j) where S is
+    the total service time of every request before j.
+    """
+    before = np.cumsum(services) - services
+    return before + np.maximum.accumulate(arrivals - before)
+
+
+def heap_starts(arrivals, services, cap):
+    """ Start times of cap FIFO servers sharing a single queue """
+    free = [0.0] * cap
+    starts = np.empty_like(arrivals)
+    for i, (t_arrive, t_processing) in enumerate(
+            zip(arrivals.tolist(), services.tolist())):
+        t_start = max(t_arrive, free[0])
+        heapq.heapreplace(free, t_start + t_processing)
+        starts[i] = t_start
+    return starts
+
+
+def grouped_fifo_starts(arrivals, services, assignment, cap):
+    """ When each request starts on its FIFO worker, arrivals in any order
+
+    Requests are sorted by (worker, arrival) once, then each worker's
+    contiguous run is solved on its own.
+    """
+    order = np.lexsort((arrivals, assignment))
+    ordered_arrivals, ordered_services = arrivals[order], services[order]
+    bounds = np.searchsorted(
+        assignment[order], np.arange(assignment.max() + 2)
+    ) if len(assignment) else np.zeros(1, dtype=np.int64)
+    ordered_starts = np.empty_like(ordered_arrivals)
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if lo == hi:
+            continue
+        if cap == 1:
+            ordered_starts[lo:hi] = lindley_starts(
+                ordered_arrivals[lo:hi], ordered_services[lo:hi]
+            )
+        else:
+            ordered_starts[lo:hi] = heap_starts(
+                ordered_arrivals[lo:hi], ordered_services[lo:hi], cap
+            )
+    starts = np.empty_like(ordered_starts)
+    starts[order] = ordered_starts
+    return starts
+
+
+def run_simulation(
+        worker_desc, load_balancer, num_requests, request_per_s, latency_fn,
+        seed=1, arrival_process=None):
+    simulator = FastRequestSimulator(
+        worker_desc, load_balancer, latency_fn,
+        num_requests, request_per_s, seed=seed,
+        arrival_process=arrival_process
+    )
+    simulator.simulate()
+    return simulator.data
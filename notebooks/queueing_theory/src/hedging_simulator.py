@@ -0,0 +1,323 @@
+import heapq
+import itertools
+import random
+from collections import deque
+
+import numpy as np
+
+from arrivals import open_loop_times
+from latency_distributions import seed_latency_fn
+from latency_recorder import LatencyRecorder
+from lb_state import lb_hooks
+from online_stats import QuantileSketch
+
+QUEUED, RUNNING, FINISHED, CANCELLED = range(4)
+HEDGE, DONE = range(2)
+
+
+class FixedDelay(object):
+    """ Hedge a request once it has been outstanding for delay_ms """
+
+    def __init__(self, delay_ms):
+        self.delay_ms = delay_ms
+
+    def delay(self):
+        return self.delay_ms
+
+    def record(self, latency):
+        pass
+
+
+class PercentileDelay(object):
+    """ Hedge a request once it is slower than the observed pN
+
+    The percentile is estimated from the latency of every request completed
+    so far and refreshed every update_every requests. Nothing is hedged
+    until min_samples requests have completed.
+
+    :param quantile: Hedge requests slower than this quantile, e.g. 0.95
+    """
+
+    def __init__(self, quantile=0.95, min_samples=1000, update_every=1000):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.update_every = update_every
+        self.sketch = QuantileSketch(relative_accuracy=0.01)
+        self.delay_ms = float('inf')
+
+    def delay(self):
+        return self.delay_ms
+
+    def record(self, latency):
+        self.sketch.add(latency)
+        count = self.sketch.count
+        if count >= self.min_samples and count % self.update_every == 0:
+            self.delay_ms = self.sketch.quantile(self.quantile)
+
+
+class HedgeBudget(object):
+    """ A token bucket that limits hedges to a fraction of requests
+
+    Every request adds ratio tokens (up to burst) and every hedge spends one,
+    like the retry throttling of gRPC or Envoy.
+    """
+
+    def __init__(self, ratio=0.05, burst=10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def add_request(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_hedge(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Worker(object):
+    """ A FIFO worker, count and queue are what lb_policies.queue_size uses """
+    __slots__ = ('index', 'zone', 'count', 'queue')
+
+    def __init__(self, index):
+        self.index = index
+        self.zone = "abc"[index % 3]
+        self.count = 0
+        self.queue = deque()
+
+
+class Copy(object):
+    """ One of the replicas sent for a request """
+    __slots__ = ('request', 'worker', 't_start', 't_processing', 'state')
+
+    def __init__(self, request, worker):
+        self.request = request
+        self.worker = worker
+        self.t_start = None
+        self.t_processing = None
+        self.state = QUEUED
+
+
+class HedgingSimulator(object):
+    """ Simulates hedged requests over k FIFO workers with an event heap
+
+    Every request is sent to the worker picked by the load balancer. If it
+    hasn't completed after the hedge delay another copy is sent to a random
+    worker that doesn't have one yet, and so on up to max_replicas copies.
+    The first copy to finish completes the request. With cancel the other
+    copies are removed from their worker's queue, or stopped if they are
+    already being processed. Without it they run to completion.
+
+    :param worker_desc: A tuple of (count, capacity) to construct workers with
+    :param load_balancer: Picks the worker for the first copy of a request,
+        a function from lb_policies or a balancer from lb_state
+    :param latency_fn: A function which takes the request number and the
+        worker processing a copy and returns the number of milliseconds the
+        copy takes to process
+    :param number_of_requests: The number of requests to run through the
+        simulator
+    :param request_per_s: The rate of requests per second.
+    :param hedge_delay: Milliseconds before hedging, or a FixedDelay or
+        PercentileDelay
+    :param max_replicas: The most copies of a request to send, 1 disables
+        hedging
+    :param budget: An optional HedgeBudget limiting how often we hedge
+    :param cancel: Whether to cancel the other copies once one finishes
+    :param seed: What random and np.random are seeded with before simulating
+    :param arrival_process: An open loop ArrivalProcess from arrivals,
+        defaults to Poisson arrivals at request_per_s
+    """
+
+    def __init__(
+            self, worker_desc, load_balancer, latency_fn,
+            number_of_requests, request_per_s, hedge_delay=10.0,
+            max_replicas=2, budget=None, cancel=True, seed=1,
+            arrival_process=None):
+        self.worker_desc = worker_desc
+        self.load_balancer = load_balancer
+        self.latency_fn = latency_fn
+        self.number_of_requests = int(number_of_requests)
+        self.request_interval_ms = 1. / (request_per_s / 1000.)
+        if not hasattr(hedge_delay, 'delay'):
+            hedge_delay = FixedDelay(hedge_delay)
+        self.hedge_delay = hedge_delay
+        self.max_replicas = max_replicas
+        self.budget = budget
+        self.cancel = cancel
+        self.seed = seed
+        if arrival_process is not None and arrival_process.closed:
+            raise ValueError(
+                'The hedging simulator needs open loop arrivals'
+            )
+        self.arrival_process = arrival_process
+        self.data = LatencyRecorder().to_array()
+        self.stats = {}
+
+    def simulate(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        seed_latency_fn(self.latency_fn, self.seed)
+
+        count, self.capacity = self.worker_desc
+        self.workers = [Worker(i) for i in range(count)]
+        self.enqueue, self.dequeue = lb_hooks(self.load_balancer, count)
+        self.recorder = LatencyRecorder()
+        self.events = []
+        self.sequence = itertools.count()
+        # The copies of every request that hasn't completed yet
+        self.live = {}
+        self.busy_ms = 0.0
+        self.useful_ms = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.cancelled_running = 0
+        self.cancelled_queued = 0
+
+        self.arrivals = arrivals = open_loop_times(
+            self.arrival_process, self.number_of_requests,
+            self.request_interval_ms
+        )
+        n = len(arrivals)
+        arrivals = arrivals.tolist()
+
+        events = self.events
+        i = 0
+        while i < n or events:
+            if i < n and (not events or arrivals[i] <= events[0][0]):
+                self.arrive(i, arrivals[i])
+                i += 1
+                continue
+            now, _, kind, payload = heapq.heappop(events)
+            if kind == DONE:
+                self.finish(payload, now)
+            else:
+                self.hedge(payload, now)
+
+        self.data = self.recorder.to_array()
+        self.stats = {
+            'requests': n,
+            'hedges': self.hedges,
+            'hedge_rate': self.hedges / float(n) if n else 0.0,
+            'hedge_wins': self.hedge_wins,
+            'cancelled_running': self.cancelled_running,
+            'cancelled_queued': self.cancelled_queued,
+            'busy_ms': self.busy_ms,
+            'useful_ms': self.useful_ms,
+            # The extra work hedging costs relative to the work that counted
+            'extra_load': (
+                self.busy_ms / self.useful_ms - 1 if self.useful_ms else 0.0
+            ),
+        }
+
+    def arrive(self, request, now):
+        if self.budget is not None:
+            self.budget.add_request()
+        idx = self.load_balancer(request, self.workers)
+        self.live[request] = [self.send(request, idx, now)]
+        if self.max_replicas > 1:
+            self.schedule_hedge(request, now)
+
+    def schedule_hedge(self, request, now):
+        delay = self.hedge_delay.delay()
+        if delay != float('inf'):
+            heapq.heappush(
+                self.events, (now + delay, next(self.sequence), HEDGE, request)
+            )
+
+    def hedge(self, request, now):
+        copies = self.live.get(request)
+        if copies is None:
+            return
+        if self.budget is not None and not self.budget.try_hedge():
+            return
+        used = set(c.worker for c in copies)
+        if len(used) == len(self.workers):
+            return
+        idx = random.randrange(len(self.workers))
+        while idx in used:
+            idx = random.randrange(len(self.workers))
+        copies.append(self.send(request, idx, now))
+        self.hedges += 1
+        if len(copies) < self.max_replicas:
+            self.schedule_hedge(request, now)
+
+    def send(self, request, idx, now):
+        copy = Copy(request, idx)
+        worker = self.workers[idx]
+        if self.enqueue:
+            self.enqueue(idx)
+        if worker.count < self.capacity:
+            self.start(copy, worker, now)
+        else:
+            worker.queue.append(copy)
+        return copy
+
+    def start(self, copy, worker, now):
+        worker.count += 1
+        copy.state = RUNNING
+        copy.t_start = now
+        copy.t_processing = self.latency_fn(copy.request, worker)
+        heapq.heappush(
+            self.events,
+            (now + copy.t_processing, next(self.sequence), DONE, copy)
+        )
+
+    def release(self, copy, now):
+        """ Free the worker copy was using (or waiting for) """
+        worker = self.workers[copy.worker]
+        if self.dequeue:
+            self.dequeue(copy.worker)
+        if copy.state == QUEUED:
+            worker.queue.remove(copy)
+            return
+        worker.count -= 1
+        self.busy_ms += now - copy.t_start
+        while worker.queue and worker.count < self.capacity:
+            self.start(worker.queue.popleft(), worker, now)
+
+    def finish(self, copy, now):
+        if copy.state == CANCELLED:
+            return
+        self.release(copy, now)
+        copy.state = FINISHED
+        copies = self.live.pop(copy.request, None)
+        if copies is None:
+            # A copy that lost and wasn't cancelled
+            return
+
+        t_total = now - self.arrivals[copy.request]
+        self.useful_ms += copy.t_processing
+        if copy is not copies[0]:
+            self.hedge_wins += 1
+        self.recorder.record(
+            t_total - copy.t_processing, copy.t_processing, t_total,
+            copy.worker, copy.request
+        )
+        self.hedge_delay.record(t_total)
+
+        if self.cancel:
+            for other in copies:
+                if other.state == RUNNING:
+                    self.cancelled_running += 1
+                elif other.state == QUEUED:
+                    self.cancelled_queued += 1
+                else:
+                    continue
+                self.release(other, now)
+                other.state = CANCELLED
+
+
+def run_hedging(
+        worker_desc, load_balancer, num_requests, request_per_s, latency_fn,
+        hedge_delay=10.0, max_replicas=2, budget=None,
+        cancel=True, seed=1, arrival_process=None):
+    simulator = HedgingSimulator(
+        worker_desc, load_balancer, latency_fn,
+        num_requests, request_per_s, hedge_delay=hedge_delay,
+        max_replicas=max_replicas, budget=budget, cancel=cancel, seed=seed,
+        arrival_process=arrival_process
+    )
+    simulator.simulate()
+    return simulator.data, simulator.stats
@@ -4,6 +4,11 @@ from collections import namedtuple
 import numpy as np
 import simpy
 
+from arrivals import PoissonArrivals
+from latency_distributions import seed_latency_fn
+from latency_recorder import LatencyRecorder
+from lb_state import lb_hooks
+
 LatencyDatum = namedtuple(
     'LatencyDatum',
     ('t_queued', 't_processing', 't_total')
@@ -22,50 +27,101 @@ class LatencyAwareRequestSimulator(object):
     :param number_of_requests: The number of requests to run through the
         simulator
     :param request_per_s: The rate of requests per second.
+    :param seed: What random and np.random are seeded with before simulating
+    :param collectors: Online collectors (see online_stats) that are handed
+        every finished request
+    :param stop_when: A stopping rule such as
+        online_stats.PercentileStoppingRule, no more requests are sent once
+        it has converged
+    :param keep_data: Whether to keep every request in data, turn this off
+        to run in constant memory with collectors
+    :param arrival_process: When requests are sent, an ArrivalProcess from
+        arrivals. Defaults to Poisson arrivals at request_per_s
     """
 
     def __init__(
             self, worker_desc, load_balancer, latency_fn,
-            number_of_requests, request_per_s):
+            number_of_requests, request_per_s, seed=1,
+            collectors=(), stop_when=None, keep_data=True,
+            arrival_process=None):
         self.worker_desc = worker_desc
         self.load_balancer = load_balancer
         self.latency_fn = latency_fn
         self.number_of_requests = int(number_of_requests)
         self.request_interval_ms = 1. / (request_per_s / 1000.)
-        self.data = []
+        self.seed = seed
+        self.collectors = list(collectors)
+        if stop_when is not None:
+            self.collectors.append(stop_when)
+        self.stop_when = stop_when
+        self.keep_data = keep_data
+        if arrival_process is None:
+            arrival_process = PoissonArrivals()
+        self.arrival_process = arrival_process
+        self.data = LatencyRecorder().to_array()
         self.requests_per_worker = {}
 
     def simulate(self):
         # Setup and start the simulation
-        random.seed(1)
-        np.random.seed(1)
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        seed_latency_fn(self.latency_fn, self.seed)
 
         self.env = simpy.Environment()
+        self.recorder = LatencyRecorder()
         self.workers = []
         idx = 0
         for cap in self.worker_desc:
-            self.workers.append(simpy.Resource(self.env, capacity=cap))
+            worker = simpy.Resource(self.env, capacity=cap)
+            worker.index = idx
+            self.workers.append(worker)
             self.requests_per_worker[idx] = 0
             idx += 1
-        self.env.process(self.generate_requests())
+        self.enqueue, self.dequeue = lb_hooks(
+            self.load_balancer, len(self.workers)
+        )
+        self.start_arrivals()
         self.env.run()
-
-    def generate_requests(self):
-        for i in range(self.number_of_requests):
-            t_processing = self.latency_fn(i)
-            idx = self.load_balancer(i, self.workers, t_processing)
-            self.requests_per_worker[idx] += 1
-            worker = self.workers[idx]
-            response = self.process_request(
-                i, worker, t_processing
-            )
-            self.env.process(response)
-            # Exponential inter-arrival times == Poisson
-            arrival_interval = random.expovariate(
-                1.0 / self.request_interval_ms
-            )
+        self.data = self.recorder.to_array()
+
+    def start_arrivals(self):
+        intervals = self.arrival_process.intervals(self.request_interval_ms)
+        if not self.arrival_process.closed:
+            self.env.process(self.generate_requests(intervals))
+            return
+        # Clients share the request numbers and think times
+        requests = iter(range(self.number_of_requests))
+        for _ in range(self.arrival_process.clients):
+            self.env.process(self.run_client(requests, intervals))
+
+    def generate_requests(self, intervals):
+        for i, arrival_interval in zip(
+                range(self.number_of_requests), intervals):
+            if self.stop_when is not None and self.stop_when.converged:
+                break
+            self.send_request(i)
             yield self.env.timeout(arrival_interval)
 
+    def run_client(self, requests, think_times):
+        """ A closed loop client, waits for each response before thinking
+        and sending its next request """
+        for i, think_time in zip(requests, think_times):
+            if self.stop_when is not None and self.stop_when.converged:
+                break
+            yield self.send_request(i)
+            yield self.env.timeout(think_time)
+
+    def send_request(self, request_id):
+        t_processing = self.latency_fn(request_id)
+        idx = self.load_balancer(request_id, self.workers, t_processing)
+        if self.enqueue:
+            self.enqueue(idx)
+        self.requests_per_worker[idx] += 1
+        worker = self.workers[idx]
+        return self.env.process(
+            self.process_request(request_id, worker, t_processing)
+        )
+
     def process_request(self, request_id, worker, duration):
         """ Request arrives, possibly queues, and then processes"""
         t_arrive = self.env.now
@@ -81,15 +137,29 @@ class LatencyAwareRequestSimulator(object):
             t_processing = t_done - t_start
             t_total_response = t_done - t_arrive
 
-            datum = LatencyDatum(t_queued, t_processing, t_total_response)
-            self.data.append(datum)
+            if self.keep_data:
+                self.recorder.record(
+                    t_queued, t_processing, t_total_response, worker.index,
+                    request_id
+                )
+            for collector in self.collectors:
+                collector.record(
+                    t_queued, t_processing, t_total_response, worker.index,
+                    t_done
+                )
+            if self.dequeue:
+                self.dequeue(worker.index)
 
 
 def run_simulation(
-        worker_desc, load_balancer, num_requests, request_per_s, latency_fn):
+        worker_desc, load_balancer, num_requests, request_per_s, latency_fn,
+        seed=1, collectors=(), stop_when=None, keep_data=True,
+        arrival_process=None):
     simulator = LatencyAwareRequestSimulator(
         worker_desc, load_balancer, latency_fn,
-        num_requests, request_per_s
+        num_requests, request_per_s, seed=seed, collectors=collectors,
+        stop_when=stop_when, keep_data=keep_data,
+        arrival_process=arrival_process
     )
     simulator.simulate()
     return simulator.data, simulator.requests_per_worker
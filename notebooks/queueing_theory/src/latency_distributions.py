@@ -1,4 +1,4 @@
-import random
+import abc
 
 import numpy as np
 
@@ -7,33 +7,130 @@ def zone(request):
     return "abc"[request % 3]
 
 
-def service(mean, slow, shape, slow_freq, slow_count):
-    scale = mean - mean / shape
-    scale_slow = slow - slow / shape
+class BlockSampler(abc.ABC):
+    """ A latency function that draws from blocks of Generator samples
 
-    def latency(request, worker):
-        base = ((np.random.pareto(shape) + 1) * scale)
+    Calling it as latency(request, worker) hands out the next value of a
+    pre-filled block, so a request costs a list lookup instead of a scalar
+    NumPy call. sample(n) returns n latencies at once for the vectorized
+    engines. Samples come from an explicit Generator: the simulators reseed
+    it with their own seed through reset (see seed_latency_fn), so runs are
+    reproducible and every replicate of a sweep gets a different stream.
+
+    Subclasses implement draw(n).
+
+    :param seed: The seed of the Generator until a simulator resets it
+    :param block_size: How many samples to draw at once
+    """
+    # Whether a latency depends on the request and worker it is called
+    # with, which the vectorized engines can't do in bulk
+    worker_dependent = False
+
+    def __init__(self, seed=None, block_size=1 << 14):
+        self.block_size = block_size
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.block = []
+        self.position = 0
+
+    @abc.abstractmethod
+    def draw(self, n):
+        """ n latencies drawn from self.rng, as a numpy array """
+
+    def sample(self, n):
+        return self.draw(n)
+
+    def next_value(self):
+        if self.position >= len(self.block):
+            self.block = self.draw(self.block_size).tolist()
+            self.position = 0
+        self.position += 1
+        return self.block[self.position - 1]
+
+    def __call__(self, request, worker=None):
+        return self.next_value()
+
+
+class Pareto(BlockSampler):
+    """ Pareto latencies with the given mean and shape (aka skew) """
+
+    def __init__(self, mean, shape, seed=None, block_size=1 << 14):
+        # mean = scale * shape / (shape - 1)
+        # solve for scale given mean and shape (aka skew)
+        self.scale = mean - mean / shape
+        self.shape = shape
+        super(Pareto, self).__init__(seed, block_size)
+
+    def draw(self, n):
+        return (self.rng.pareto(self.shape, n) + 1) * self.scale
+
+
+class Exponential(BlockSampler):
+    """ Exponential latencies with the given mean """
+
+    def __init__(self, mean, seed=None, block_size=1 << 14):
+        self.mean = mean
+        super(Exponential, self).__init__(seed, block_size)
+
+    def draw(self, n):
+        return self.rng.exponential(self.mean, n)
+
+
+class Service(BlockSampler):
+    """ A pareto service that is slower across zones and on some requests
+
+    Requests to a worker in another zone take 0.8ms longer, and slow_count
+    of every slow_freq requests add a second pareto delay with mean slow.
+    sample(n) is for requests 0 to n - 1 served in their own zone.
+    """
+    worker_dependent = True
+
+    def __init__(self, mean, slow, shape, slow_freq, slow_count, seed=None,
+                 block_size=1 << 14):
+        self.scale = mean - mean / shape
+        self.scale_slow = slow - slow / shape
+        self.shape = shape
+        self.slow_freq = slow_freq
+        self.slow_count = slow_count
+        super(Service, self).__init__(seed, block_size)
+
+    def draw(self, n):
+        # Pareto samples of scale 1, scaled to the base or slow delay
+        return self.rng.pareto(self.shape, n) + 1
+
+    def sample(self, n):
+        latency = self.draw(n) * self.scale
+        slow = np.flatnonzero(np.arange(n) % self.slow_freq < self.slow_count)
+        latency[slow] += self.draw(len(slow)) * self.scale_slow
+        return latency
+
+    def __call__(self, request, worker):
+        base = self.next_value() * self.scale
         if (zone(request) != worker.zone):
             base += 0.8
-        if (request % slow_freq) < slow_count:
-            add_l = ((np.random.pareto(shape) + 1) * scale_slow)
+        if (request % self.slow_freq) < self.slow_count:
+            add_l = self.next_value() * self.scale_slow
         else:
             add_l = 0
         return base + add_l
-    return latency
 
 
-def pareto(mean, shape):
-    # mean = scale * shape / (shape - 1)
-    # solve for scale given mean and shape (aka skew)
-    scale = mean - mean / shape
+def seed_latency_fn(latency_fn, seed):
+    """ Reseed a BlockSampler, plain latency functions are left alone """
+    reset = getattr(latency_fn, 'reset', None)
+    if reset is not None:
+        reset(seed)
+
+
+def service(mean, slow, shape, slow_freq, slow_count, seed=None):
+    return Service(mean, slow, shape, slow_freq, slow_count, seed=seed)
+
 
-    def latency(request, worker):
-        return ((np.random.pareto(shape) + 1) * scale)
-    return latency
+def pareto(mean, shape, seed=None):
+    return Pareto(mean, shape, seed=seed)
 
 
-def expon(mean):
-    def latency(request, worker):
-        return random.expovariate(1.0 / mean)
-    return latency
+def expon(mean, seed=None):
+    return Exponential(mean, seed=seed)
@@ -0,0 +1,63 @@
+from array import array
+
+import numpy as np
+
+# The columns of a simulation result. The first three match LatencyDatum so
+# rows can still be used as datum[2] or datum.t_total
+LATENCY_DTYPE = np.dtype([
+    ('t_queued', np.float64),
+    ('t_processing', np.float64),
+    ('t_total', np.float64),
+    ('worker', np.int32),
+    ('request_id', np.int64),
+])
+
+
+class LatencyRecorder(object):
+    """ Records the latency of every request into compact columns
+
+    Each column is an array.array of machine types, so a request costs 36
+    bytes instead of a namedtuple of three float objects, and appending is
+    about as cheap as appending to a list.
+    """
+
+    def __init__(self):
+        self.columns = [
+            array('d'), array('d'), array('d'), array('i'), array('q')
+        ]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def record(self, t_queued, t_processing, t_total, worker, request_id):
+        t_queued_col, t_processing_col, t_total_col, worker_col, id_col = (
+            self.columns
+        )
+        t_queued_col.append(t_queued)
+        t_processing_col.append(t_processing)
+        t_total_col.append(t_total)
+        worker_col.append(worker)
+        id_col.append(request_id)
+
+    def to_array(self):
+        """ The recorded requests as a record array of LATENCY_DTYPE
+
+        Columns can be sliced directly (data.t_total, data['worker']) and
+        rows behave like LatencyDatum (row[2], row.t_total).
+        """
+        return from_columns(*(
+            np.frombuffer(column, dtype=column.typecode)
+            if len(column) else np.zeros(0)
+            for column in self.columns
+        ))
+
+
+def from_columns(t_queued, t_processing, t_total, worker, request_id):
+    """ Build a LATENCY_DTYPE record array from equal length columns """
+    data = np.empty(len(t_total), dtype=LATENCY_DTYPE)
+    data['t_queued'] = t_queued
+    data['t_processing'] = t_processing
+    data['t_total'] = t_total
+    data['worker'] = worker
+    data['request_id'] = request_id
+    return data.view(np.recarray)
@@ -1,7 +1,5 @@
 import random
 
-import numpy as np
-
 
 def queue_size(resource):
     return resource.count + len(resource.queue)
@@ -16,7 +14,6 @@ def rr_lb(request_num, workers):
 
 
 def choice_two_lb(request_num, workers):
-    r1, r2 = np.random.choice(range(len(workers)), 2, replace=False)
     r1 = random_lb(request_num, workers)
     r2 = random_lb(request_num, workers)
     if queue_size(workers[r1]) < queue_size(workers[r2]):
@@ -30,7 +27,8 @@ def _zone(request):
 
 def choice_n_weighted(n):
     def lb(request_num, workers):
-        choices = np.random.choice(range(len(workers)), n, replace=False)
+        # random.sample doesn't build the whole range, so this is O(n)
+        choices = random.sample(range(len(workers)), n)
         result = []
         for idx, w in enumerate(choices):
             weight = 1.0
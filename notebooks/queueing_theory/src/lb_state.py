@@ -0,0 +1,143 @@
+import abc
+import random
+
+
+class QueueDepths(object):
+    """ The queue depth of every worker, kept up to date incrementally
+
+    Depths are kept in a list for O(1) lookups, and in a segment tree of
+    (depth, index) keys so that the shallowest worker (lowest index on ties,
+    like shortest_queue_lb) is always at the root. Enqueueing or dequeueing
+    a request is O(log n).
+
+    :param count: The number of workers
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.depths = [0] * count
+        self.size = 1
+        while self.size < max(count, 1):
+            self.size *= 2
+        # A key of depth * size + index orders by depth then index
+        self.tree = [float('inf')] * (2 * self.size)
+        for idx in range(count):
+            self.tree[self.size + idx] = idx
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def _set(self, idx, depth):
+        self.depths[idx] = depth
+        tree = self.tree
+        i = self.size + idx
+        tree[i] = depth * self.size + idx
+        while i > 1:
+            i >>= 1
+            tree[i] = min(tree[2 * i], tree[2 * i + 1])
+
+    def enqueue(self, idx):
+        self._set(idx, self.depths[idx] + 1)
+
+    def dequeue(self, idx):
+        self._set(idx, self.depths[idx] - 1)
+
+    def shortest(self):
+        """ The index of the worker with the fewest outstanding requests """
+        return int(self.tree[1] % self.size)
+
+    def sample(self, d):
+        """ d distinct random worker indices in O(d) """
+        return random.sample(range(self.count), min(d, self.count))
+
+
+class StatefulBalancer(abc.ABC):
+    """ A load balancer that tracks queue depths itself
+
+    Instances are called like the functions in lb_policies. Simulators call
+    reset with the number of workers before a run, and enqueue / dequeue as
+    requests are sent to and finish on a worker, so that picking a worker
+    never has to look at every worker's queue.
+    """
+
+    def __init__(self):
+        self.state = None
+
+    def reset(self, count):
+        self.state = QueueDepths(count)
+
+    def enqueue(self, idx):
+        self.state.enqueue(idx)
+
+    def dequeue(self, idx):
+        self.state.dequeue(idx)
+
+    def __call__(self, request_num, workers, *args):
+        if self.state is None or self.state.count != len(workers):
+            self.reset(len(workers))
+        return self.choose(request_num, workers)
+
+    @abc.abstractmethod
+    def choose(self, request_num, workers):
+        """ The index of the worker to send request_num to """
+
+
+class ShortestQueue(StatefulBalancer):
+    """ Join the shortest queue, like shortest_queue_lb but O(log n) """
+
+    def choose(self, request_num, workers):
+        return self.state.shortest()
+
+
+class ChoiceOfD(StatefulBalancer):
+    """ Join the shortest of d randomly chosen queues, i.e. JSQ(d)
+
+    :param d: How many distinct workers to compare
+    """
+
+    def __init__(self, d=2):
+        super(ChoiceOfD, self).__init__()
+        self.d = d
+
+    def choose(self, request_num, workers):
+        depths = self.state.depths
+        return min(self.state.sample(self.d), key=depths.__getitem__)
+
+
+class ZoneWeightedChoice(StatefulBalancer):
+    """ Like choice_n_weighted, but O(d) per request
+
+    Of d randomly chosen workers pick the one with the smallest
+    weight * (1 + queue depth), where the weight is 1 for workers in the
+    request's zone and cross_zone_weight otherwise.
+
+    :param d: How many distinct workers to compare
+    :param cross_zone_weight: How much worse a worker in another zone is
+    """
+
+    def __init__(self, d=2, cross_zone_weight=4.0):
+        super(ZoneWeightedChoice, self).__init__()
+        self.d = d
+        self.cross_zone_weight = cross_zone_weight
+
+    def choose(self, request_num, workers):
+        depths = self.state.depths
+        zone = "abc"[request_num % 3]
+
+        def cost(idx):
+            weight = 1.0
+            if workers[idx].zone != zone:
+                weight = self.cross_zone_weight
+            return weight * (1 + depths[idx])
+        return min(self.state.sample(self.d), key=cost)
+
+
+def lb_hooks(load_balancer, count):
+    """ Reset a stateful load balancer and return its (enqueue, dequeue)
+
+    Plain load balancer functions have no hooks, so both are None.
+    """
+    reset = getattr(load_balancer, 'reset', None)
+    if reset is None:
+        return None, None
+    reset(count)
+    return load_balancer.enqueue, load_balancer.dequeue
@@ -0,0 +1,210 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+# Collectors are handed every finished request by the simulators as
+# record(t_queued, t_processing, t_total, worker, t_done) and keep O(1)
+# (or O(log range)) state rather than every sample. Collectors of the same
+# kind can be merged, e.g. across runs of a sweep.
+FIELDS = ('t_queued', 't_processing', 't_total')
+
+
+class Welford(object):
+    """ Streaming mean and variance of one field of the requests
+
+    :param field: Which of t_queued, t_processing or t_total to track
+    """
+
+    def __init__(self, field='t_total'):
+        self.field = FIELDS.index(field)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def record(self, t_queued, t_processing, t_total, worker, t_done):
+        self.add((t_queued, t_processing, t_total)[self.field])
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return float('nan')
+        return self.m2 / (self.count - 1)
+
+    def merge(self, other):
+        """ Fold other into this one (Chan et al's parallel update) """
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+
+class QuantileSketch(object):
+    """ A mergeable quantile sketch with bounded relative error
+
+    Values are counted in logarithmic buckets of ratio gamma, so any
+    quantile is returned within relative_accuracy of the true sample value
+    (the DDSketch construction). Memory grows with log(max / min) rather
+    than the number of samples, and sketches with the same accuracy merge
+    by adding their bucket counts.
+
+    :param relative_accuracy: The relative error of returned quantiles
+    :param field: Which of t_queued, t_processing or t_total to track
+    :param min_value: Values at or below this are counted as zero
+    """
+
+    def __init__(self, relative_accuracy=0.01, field='t_total',
+                 min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.field = FIELDS.index(field)
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        idx = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+    def add_many(self, values):
+        """ Add an array of values at once """
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > self.min_value]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        if not len(positive):
+            return
+        idx = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+        low = idx.min()
+        counts = np.bincount(idx - low)
+        for offset in np.flatnonzero(counts):
+            key = int(low + offset)
+            self.buckets[key] = self.buckets.get(key, 0) + int(counts[offset])
+
+    def record(self, t_queued, t_processing, t_total, worker, t_done):
+        self.add((t_queued, t_processing, t_total)[self.field])
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Can only merge sketches of the same accuracy')
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantiles(self, quantiles):
+        """ The values at each of quantiles (in [0, 1]), nan when empty """
+        if self.count == 0:
+            return [float('nan')] * len(quantiles)
+        keys = sorted(self.buckets)
+        cumulative = np.cumsum([self.buckets[k] for k in keys])
+        result = []
+        for quantile in quantiles:
+            rank = quantile * (self.count - 1)
+            if rank < self.zero_count:
+                result.append(0.0)
+                continue
+            i = int(np.searchsorted(
+                cumulative, rank - self.zero_count, side='right'
+            ))
+            idx = keys[min(i, len(keys) - 1)]
+            result.append(2 * self.gamma ** idx / (self.gamma + 1))
+        return result
+
+    def quantile(self, quantile):
+        return self.quantiles([quantile])[0]
+
+
+class WorkerUtilization(object):
+    """ The fraction of time each worker spent processing requests
+
+    :param count: The number of workers
+    :param capacity: How many requests each worker processes at once
+    """
+
+    def __init__(self, count, capacity=1):
+        self.capacity = capacity
+        self.busy = np.zeros(count)
+        self.requests = np.zeros(count, dtype=np.int64)
+        self.elapsed = 0.0
+
+    def record(self, t_queued, t_processing, t_total, worker, t_done):
+        self.busy[worker] += t_processing
+        self.requests[worker] += 1
+        self.elapsed = max(self.elapsed, t_done)
+
+    def merge(self, other):
+        self.busy += other.busy
+        self.requests += other.requests
+        self.elapsed += other.elapsed
+        return self
+
+    def utilization(self):
+        if self.elapsed == 0:
+            return np.zeros_like(self.busy)
+        return self.busy / (self.elapsed * self.capacity)
+
+
+class PercentileStoppingRule(object):
+    """ Decides when a percentile estimate is precise enough to stop
+
+    Uses the order statistic confidence interval of the quantile: with n
+    samples the true quantile q lies between the sample quantiles at
+    q -/+ z * sqrt(q * (1 - q) / n). Once half that interval is within
+    relative_error of the estimate the rule has converged. Queueing delays
+    are autocorrelated, so this interval is optimistic. Use a larger
+    min_samples, or a smaller relative_error, for heavily loaded systems.
+
+    :param quantile: The quantile to estimate, e.g. 0.99
+    :param relative_error: The acceptable CI half width over the estimate
+    :param confidence: The confidence level of the interval
+    :param min_samples: Never converge before this many samples
+    :param check_every: Only re-check the interval every this many samples
+    :param field: Which of t_queued, t_processing or t_total to track
+    """
+
+    def __init__(self, quantile=0.99, relative_error=0.05, confidence=0.95,
+                 min_samples=10000, check_every=1000, field='t_total'):
+        self.quantile = quantile
+        self.relative_error = relative_error
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+        self.min_samples = min_samples
+        self.check_every = check_every
+        self.sketch = QuantileSketch(
+            relative_accuracy=relative_error / 4.0, field=field
+        )
+        self.converged = False
+        self.interval = None
+
+    def record(self, t_queued, t_processing, t_total, worker, t_done):
+        self.sketch.record(t_queued, t_processing, t_total, worker, t_done)
+        count = self.sketch.count
+        if count >= self.min_samples and count % self.check_every == 0:
+            self.check()
+
+    def check(self):
+        q, n = self.quantile, self.sketch.count
+        spread = self.z * math.sqrt(q * (1 - q) / n)
+        low, estimate, high = self.sketch.quantiles(
+            [max(q - spread, 0.0), q, min(q + spread, 1.0)]
+        )
+        self.interval = (low, estimate, high)
+        self.converged = (high - low) / 2.0 <= self.relative_error * estimate
+        return self.converged
@@ -4,6 +4,11 @@ from collections import namedtuple
 import numpy as np
 import simpy
 
+from arrivals import PoissonArrivals
+from latency_distributions import seed_latency_fn
+from latency_recorder import LatencyRecorder
+from lb_state import lb_hooks
+
 LatencyDatum = namedtuple(
     'LatencyDatum',
     ('t_queued', 't_processing', 't_total')
@@ -19,94 +24,170 @@ class SpeculatingRequestExecutor(object):
         and the list of workers and returns the index of the worker to
         send the next request to
     :param latency_fn: A function which takes the curent request number and the
-        worker that was assigned by the load balancer and returns the number of
+        worker that got to process it first and returns the number of
         milliseconds a request took to process
     :param number_of_requests: The number of requests to run through the
         simulator
     :param request_per_s: The rate of requests per second.
+    :param seed: What random and np.random are seeded with before simulating
+    :param collectors: Online collectors (see online_stats) that are handed
+        every finished request
+    :param stop_when: A stopping rule such as
+        online_stats.PercentileStoppingRule, no more requests are sent once
+        it has converged
+    :param keep_data: Whether to keep every request in data, turn this off
+        to run in constant memory with collectors
+    :param arrival_process: When requests are sent, an ArrivalProcess from
+        arrivals. Defaults to Poisson arrivals at request_per_s
     """
 
     def __init__(
             self, worker_desc, load_balancer, latency_fn,
-            number_of_requests, request_per_s):
+            number_of_requests, request_per_s, seed=1,
+            collectors=(), stop_when=None, keep_data=True,
+            arrival_process=None):
         self.worker_desc = worker_desc
         self.load_balancer = load_balancer
         self.latency_fn = latency_fn
         self.number_of_requests = int(number_of_requests)
         self.request_interval_ms = 1. / (request_per_s / 1000.)
+        self.seed = seed
+        self.collectors = list(collectors)
+        if stop_when is not None:
+            self.collectors.append(stop_when)
+        self.stop_when = stop_when
+        self.keep_data = keep_data
+        if arrival_process is None:
+            arrival_process = PoissonArrivals()
+        self.arrival_process = arrival_process
         self.received_first = {'1': 0, '2': 0}
-        self.data = []
+        self.data = LatencyRecorder().to_array()
 
     def simulate(self):
         # Setup and start the simulation
-        random.seed(1)
-        np.random.seed(1)
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        seed_latency_fn(self.latency_fn, self.seed)
 
         self.env = simpy.Environment()
+        self.recorder = LatencyRecorder()
         count, cap = self.worker_desc
-        self.workers = [
-            simpy.Resource(self.env, capacity=cap) for i in range(count)
-        ]
-        self.env.process(self.generate_requests())
+        self.workers = []
+        for i in range(count):
+            worker = simpy.Resource(self.env, capacity=cap)
+            worker.zone = "abc"[i % 3]
+            worker.index = i
+            self.workers.append(worker)
+        self.enqueue, self.dequeue = lb_hooks(
+            self.load_balancer, len(self.workers)
+        )
+        self.start_arrivals()
         self.env.run()
-
-    def generate_requests(self):
-        for i in range(self.number_of_requests):
-            workers = []
-            for j in range(2):
-                idx = self.load_balancer(i, self.workers)
-                workers.append(self.workers[idx])
-            response = self.process_request(
-                i, workers[0], workers[1],
-            )
-            self.env.process(response)
-            # Exponential inter-arrival times == Poisson
-            arrival_interval = random.expovariate(
-                1.0 / self.request_interval_ms
-            )
+        self.data = self.recorder.to_array()
+
+    def start_arrivals(self):
+        intervals = self.arrival_process.intervals(self.request_interval_ms)
+        if not self.arrival_process.closed:
+            self.env.process(self.generate_requests(intervals))
+            return
+        # Clients share the request numbers and think times
+        requests = iter(range(self.number_of_requests))
+        for _ in range(self.arrival_process.clients):
+            self.env.process(self.run_client(requests, intervals))
+
+    def generate_requests(self, intervals):
+        for i, arrival_interval in zip(
+                range(self.number_of_requests), intervals):
+            if self.stop_when is not None and self.stop_when.converged:
+                break
+            self.send_request(i)
             yield self.env.timeout(arrival_interval)
 
+    def run_client(self, requests, think_times):
+        """ A closed loop client, waits for each response before thinking
+        and sending its next request """
+        for i, think_time in zip(requests, think_times):
+            if self.stop_when is not None and self.stop_when.converged:
+                break
+            yield self.send_request(i)
+            yield self.env.timeout(think_time)
+
+    def send_request(self, request_id):
+        workers = []
+        for j in range(2):
+            idx = self.load_balancer(request_id, self.workers)
+            if self.enqueue:
+                self.enqueue(idx)
+            workers.append(self.workers[idx])
+        return self.env.process(
+            self.process_request(request_id, workers[0], workers[1])
+        )
+
     def process_request(self, request_id, worker1, worker2):
         """ Request arrives, possibly queues, and then processes"""
         t_arrive = self.env.now
 
         req1 = worker1.request()
         req2 = worker2.request()
+        won = None
 
         try:
             result = yield req1 | req2
 
             if req1 in result:
+                winner, won, loser, lost = worker1, req1, worker2, req2
                 self.received_first['1'] += 1
-                req2.cancel()
-                req2.resource.release(req2)
             else:
+                winner, won, loser, lost = worker2, req2, worker1, req1
                 self.received_first['2'] += 1
-                req1.cancel()
-                req1.resource.release(req1)
+            # The loser is either still queued or, if both workers were
+            # free, already holds its worker
+            lost.cancel()
+            loser.release(lost)
+            if self.dequeue:
+                self.dequeue(loser.index)
 
             t_start = self.env.now
             t_queued = t_start - t_arrive
 
             # Let the operation take w.e. amount of time the latency
             # function tells us to
-            yield self.env.timeout(self.latency_fn(request_id))
+            yield self.env.timeout(self.latency_fn(request_id, winner))
 
             t_done = self.env.now
             t_processing = t_done - t_start
             t_total_response = t_done - t_arrive
-            self.data.append(LatencyDatum(
-                t_queued, t_processing, t_total_response))
+            if self.keep_data:
+                self.recorder.record(
+                    t_queued, t_processing, t_total_response, winner.index,
+                    request_id
+                )
+            for collector in self.collectors:
+                collector.record(
+                    t_queued, t_processing, t_total_response, winner.index,
+                    t_done
+                )
+            if self.dequeue:
+                self.dequeue(winner.index)
         finally:
-            worker1.release(req1)
-            worker2.release(req2)
+            # Only the winner still holds a worker, unless we never started
+            if won is None:
+                for worker, req in ((worker1, req1), (worker2, req2)):
+                    req.cancel()
+                    worker.release(req)
+            else:
+                winner.release(won)
 
 
 def run_speculation(
-        worker_desc, load_balancer, num_requests, request_per_s, latency_fn):
+        worker_desc, load_balancer, num_requests, request_per_s, latency_fn,
+        seed=1, collectors=(), stop_when=None, keep_data=True,
+        arrival_process=None):
     simulator = SpeculatingRequestExecutor(
         worker_desc, load_balancer, latency_fn,
-        num_requests, request_per_s
+        num_requests, request_per_s, seed=seed, collectors=collectors,
+        stop_when=stop_when, keep_data=keep_data,
+        arrival_process=arrival_process
     )
     simulator.simulate()
     return simulator.data, simulator.received_first
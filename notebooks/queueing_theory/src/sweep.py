@@ -0,0 +1,177 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from request_simulator import run_simulation
+
+# One simulation run of a sweep. load_balancer and latency_fn are
+# (name, function) pairs so that results can be labelled and resumed by name
+SweepCell = namedtuple(
+    'SweepCell',
+    ('worker_desc', 'load_balancer', 'latency_fn', 'request_per_s',
+     'num_requests', 'replicate')
+)
+
+KEY_COLUMNS = (
+    'workers', 'capacity', 'load_balancer', 'latency_fn', 'request_per_s',
+    'num_requests', 'replicate'
+)
+SWEEP_PERCENTILES = (50, 90, 99, 99.9, 99.99)
+STAT_COLUMNS = (
+    ('seed', 'count', 'mean') +
+    tuple('p{0:g}'.format(p) for p in SWEEP_PERCENTILES) +
+    ('max', 'elapsed_s')
+)
+
+# The cells of the running sweep, inherited by forked workers so that the
+# latency functions (usually closures) never need to be pickled
+_cells = None
+
+
+def make_grid(worker_descs, load_balancers, latency_fns, request_per_s,
+              num_requests, replicates=1):
+    """ Every combination of the given parameters as SweepCells
+
+    :param worker_descs: A list of (count, capacity) worker descriptions
+    :param load_balancers: A dict of name to load balancer
+    :param latency_fns: A dict of name to latency function
+    :param request_per_s: A list of request rates
+    :param num_requests: The number of requests to simulate in every cell
+    :param replicates: How many independently seeded runs of each cell
+    """
+    return [
+        SweepCell(desc, lb, fn, qps, int(num_requests), replicate)
+        for desc, lb, fn, qps, replicate in itertools.product(
+            worker_descs, sorted(load_balancers.items()),
+            sorted(latency_fns.items()), request_per_s, range(replicates)
+        )
+    ]
+
+
+def cell_key(cell):
+    """ The key columns of a cell as strings, as they appear in the csv """
+    count, cap = cell.worker_desc
+    return tuple(str(v) for v in (
+        count, cap, cell.load_balancer[0], cell.latency_fn[0],
+        cell.request_per_s, cell.num_requests, cell.replicate
+    ))
+
+
+def cell_seed(cell, base_seed=0):
+    """ A seed for cell that doesn't depend on its position in the grid
+
+    Every cell gets its own stream, derived from a hash of its key, so
+    resuming a sweep or adding cells to it does not change the results of
+    the cells that were already run.
+    """
+    digest = zlib.crc32('|'.join(cell_key(cell)).encode('utf-8'))
+    return int(
+        np.random.SeedSequence([base_seed, digest]).generate_state(1)[0]
+    )
+
+
+def completed_keys(path):
+    """ The keys of every cell already written to the results csv """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return set(
+            tuple(row[c] for c in KEY_COLUMNS) for row in csv.DictReader(f)
+        )
+
+
+def _init_worker(cells):
+    global _cells
+    _cells = cells
+
+
+def _run_cell(index, engine, seed):
+    cell = _cells[index]
+    start = time.time()
+    data = engine(
+        cell.worker_desc, cell.load_balancer[1], cell.num_requests,
+        cell.request_per_s, cell.latency_fn[1], seed=seed
+    )
+    # Some engines also return per run stats, e.g. requests_per_worker
+    if isinstance(data, tuple):
+        data = data[0]
+    if isinstance(data, np.ndarray):
+        t_total = np.asarray(data['t_total'])
+    else:
+        t_total = np.array([datum[2] for datum in data])
+    return index, dict(
+        zip(STAT_COLUMNS, (
+            seed, len(t_total), t_total.mean(),
+            *np.percentile(t_total, SWEEP_PERCENTILES),
+            t_total.max(), time.time() - start
+        ))
+    )
+
+
+def sweep(cells, path, engine=run_simulation, jobs=None, base_seed=0):
+    """ Run every cell across a process pool, appending results to path
+
+    Each finished cell becomes one row of the csv at path (key columns
+    followed by STAT_COLUMNS) as soon as it completes, and cells that are
+    already in the csv are skipped. An interrupted sweep can therefore be
+    resumed by running it again. Workers are forked so latency functions
+    and load balancers don't need to be picklable, which makes this Unix
+    only.
+
+    :param cells: SweepCells to run, e.g. from make_grid
+    :param path: The csv file to append results to
+    :param engine: A run_simulation function, e.g. from fast_simulator
+    :param jobs: The number of processes, defaults to the number of CPUs
+    :param base_seed: Changes the random stream of every cell
+    :returns: The number of cells that were run
+    """
+    done = completed_keys(path)
+    todo = [i for i, c in enumerate(cells) if cell_key(c) not in done]
+    if not todo:
+        return 0
+
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as f, ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker, initargs=(cells,)) as executor:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(KEY_COLUMNS + STAT_COLUMNS)
+            f.flush()
+        futures = [
+            executor.submit(
+                _run_cell, i, engine, cell_seed(cells[i], base_seed)
+            )
+            for i in todo
+        ]
+        for future in as_completed(futures):
+            index, stats = future.result()
+            writer.writerow(
+                cell_key(cells[index]) +
+                tuple(stats[c] for c in STAT_COLUMNS)
+            )
+            f.flush()
+    return len(todo)
+
+
+def read_results(path):
+    """ Load a sweep csv as a dict of column name to numpy array """
+    with open(path, 'r') as f:
+        rows = list(csv.DictReader(f))
+    columns = {}
+    for name in KEY_COLUMNS + STAT_COLUMNS:
+        values = [row[name] for row in rows]
+        if name in ('load_balancer', 'latency_fn'):
+            columns[name] = np.array(values)
+        else:
+            columns[name] = np.array(values, dtype=np.float64)
+    return columns
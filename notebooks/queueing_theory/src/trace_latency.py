@@ -0,0 +1,192 @@
+import os
+import tempfile
+
+import numpy as np
+
+from latency_distributions import BlockSampler
+
+# (delimiter, latency column, fields per row, milliseconds per unit) of
+# each capture format. ab -g files have six tab separated columns with
+# ttime in ms. biolatency -T style traces (e.g.
+# notebooks/biolatency_charts/ios) end with a LAT(ms) column, and as COMM
+# may contain spaces a row can split into more than its eight fields, so
+# the latency is read from the end.
+trace_formats = {
+    'ab': ('\t', 4, 6, 1.0),
+    'biolatency': (None, -1, 8, 1.0),
+}
+
+CACHE_VERSION = 2
+
+
+def parse_latencies(path, data_format='ab', chunk_lines=1 << 18):
+    """ Parse the latency column of a capture into a float64 array (in ms)
+
+    The file is parsed chunk_lines at a time so only one chunk of text is
+    in memory at once. Rows with the wrong number of fields raise a
+    ValueError rather than giving a latency from the wrong column.
+    """
+    delimiter, column, fields, scale = trace_formats[data_format]
+    # Only whitespace separated formats can gain fields from a COMM with
+    # spaces in it
+    extra_fields = delimiter is None
+    chunks = []
+    with open(path, 'r') as f:
+        next(f, None)
+        line_number = 1
+        while True:
+            lines = [f.readline() for _ in range(chunk_lines)]
+            if not lines[0]:
+                break
+            values = []
+            for line in lines:
+                line_number += 1
+                items = line.rstrip('\r\n').split(delimiter)
+                if not line.strip():
+                    continue
+                if len(items) != fields and not (
+                        extra_fields and len(items) > fields):
+                    raise ValueError(
+                        '{0}:{1}: expected {2} fields in a {3} capture, got '
+                        '{4}'.format(path, line_number, fields, data_format,
+                                     len(items))
+                    )
+                values.append(float(items[column]))
+            chunks.append(np.array(values, dtype=np.float64))
+    if not chunks:
+        return np.zeros(0)
+    return np.concatenate(chunks) * scale
+
+
+def save_array(path, array):
+    """ np.save array to path, which only appears once it is complete """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+            dir=directory, suffix='.npy', delete=False) as out:
+        try:
+            np.save(out, array)
+            out.close()
+            os.chmod(out.name, 0o644)
+            os.replace(out.name, path)
+        finally:
+            if os.path.exists(out.name):
+                os.unlink(out.name)
+
+
+def trace_arrays(path, data_format='ab', cache_dir=None):
+    """ The latencies of a capture in order and sorted, as read only memmaps
+
+    Both arrays are saved next to the capture (or in cache_dir) as .npy
+    files the first time, and are re-parsed only when the capture is newer
+    than its cache. Memory mapping them means a trace of hundreds of
+    millions of requests is paged in as it is sampled rather than loaded.
+    """
+    if data_format == 'npy':
+        raw = np.load(path, mmap_mode='r')
+        return raw, np.sort(raw)
+    base = path
+    if cache_dir is not None:
+        base = os.path.join(cache_dir, os.path.basename(path))
+    # Versioned so caches written by an older parser are not reused
+    raw_path = '{0}.{1}.v{2}.npy'.format(base, data_format, CACHE_VERSION)
+    sorted_path = '{0}.{1}.v{2}.sorted.npy'.format(
+        base, data_format, CACHE_VERSION
+    )
+    mtime = os.path.getmtime(path)
+    fresh = all(
+        os.path.exists(p) and os.path.getmtime(p) >= mtime
+        for p in (raw_path, sorted_path)
+    )
+    if not fresh:
+        raw = parse_latencies(path, data_format)
+        save_array(raw_path, raw)
+        raw.sort()
+        save_array(sorted_path, raw)
+    return (
+        np.load(raw_path, mmap_mode='r'), np.load(sorted_path, mmap_mode='r')
+    )
+
+
+class TraceLatency(BlockSampler):
+    """ A latency function that bootstraps or replays a real capture
+
+    With mode='bootstrap' latencies are drawn by inverse CDF sampling of the
+    sorted capture, i.e. resampling with replacement, optionally
+    interpolating between neighbouring order statistics so values in
+    between the captured ones can occur. With mode='replay' request i gets
+    the i-th latency of the capture (wrapping around), which keeps any
+    ordering effects such as slow periods.
+
+    Bootstrapped latencies are drawn in blocks like the other
+    latency_distributions.BlockSampler functions, replayed ones only depend
+    on the request number.
+
+    :param latencies: The captured latencies in ms, in capture order
+    :param mode: 'bootstrap' or 'replay'
+    :param interpolate: Interpolate between order statistics when
+        bootstrapping
+    :param scale: Multiply every latency by this, e.g. to model a slower
+        device
+    :param seed: The seed of the Generator until a simulator resets it
+    :param block_size: How many latencies to draw at once
+    :param sorted_latencies: latencies sorted, if they already are
+    """
+
+    def __init__(self, latencies, mode='bootstrap', interpolate=False,
+                 scale=1.0, seed=None, block_size=1 << 14,
+                 sorted_latencies=None):
+        if mode not in ('bootstrap', 'replay'):
+            raise ValueError('Unknown mode {0}'.format(mode))
+        if not len(latencies):
+            raise ValueError('Can not sample an empty trace')
+        self.latencies = latencies
+        if sorted_latencies is None:
+            sorted_latencies = np.sort(latencies)
+        self.sorted = sorted_latencies
+        self.mode = mode
+        self.interpolate = interpolate
+        self.scale = scale
+        super(TraceLatency, self).__init__(seed, block_size)
+
+    @classmethod
+    def from_file(cls, path, data_format='ab', cache_dir=None, **kwargs):
+        raw, ordered = trace_arrays(path, data_format, cache_dir)
+        return cls(raw, sorted_latencies=ordered, **kwargs)
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def quantiles(self, u):
+        """ The inverse CDF of the capture at each of u in [0, 1) """
+        n = len(self.sorted)
+        if not self.interpolate:
+            idx = np.minimum((u * n).astype(np.int64), n - 1)
+            return self.sorted[idx] * self.scale
+        position = u * (n - 1)
+        low = position.astype(np.int64)
+        high = np.minimum(low + 1, n - 1)
+        frac = position - low
+        values = self.sorted[low] * (1 - frac) + self.sorted[high] * frac
+        return values * self.scale
+
+    def draw(self, n):
+        return self.quantiles(self.rng.random(n))
+
+    def sample(self, n, start=0):
+        """ n latencies, replay starts at request number start """
+        if self.mode == 'replay':
+            idx = (np.arange(start, start + n) % len(self.latencies))
+            return self.latencies[idx] * self.scale
+        return self.draw(n)
+
+    def __call__(self, request, worker=None):
+        if self.mode == 'replay':
+            return float(
+                self.latencies[request % len(self.latencies)] * self.scale
+            )
+        return self.next_value()
+
+
+def trace_latency(path, data_format='ab', mode='bootstrap', **kwargs):
+    """ A TraceLatency for the capture at path, see trace_arrays """
+    return TraceLatency.from_file(path, data_format, mode=mode, **kwargs)